@@ -0,0 +1,128 @@
+'''
+End-to-end latency of the purchase flows against the local mock server
+
+    python -m benchmark.flow_bench kktix [--runs 20] [--latency 0.03] [--failure-rate 0.1]
+    python -m benchmark.flow_bench kham [--runs 10] [--headless]
+'''
+import argparse
+import pathlib
+import tempfile
+import time
+from typing import Callable, List
+
+import asyncio
+import nodriver as uc
+
+from core.setting import Setting
+from core.ticket_flow import Ticket_Flow, Ticket_Flow_Kham, Ticket_Flow_KKTix
+from .mock_server import EVENT_ID, PERFORMANCE_ID, Mock_Server, mock_url, scenario_arguments, scenario_from_args
+from .report import summary
+
+REAL_HOSTS = ('https://queue.kktix.com', 'https://kktix.com', 'https://www.kham.com.tw', 'https://kham.com.tw')
+
+def mock_flow(cls: type, base_url: str) -> type:
+    '''
+    subclass of a flow with every site url pointing to the mock server
+    '''
+    attrs = dict()
+    for name in dir(cls):
+        value = getattr(cls, name)
+        if name.startswith('__') or not isinstance(value, str):
+            continue
+        for host in REAL_HOSTS:
+            if value.startswith(host):
+                attrs[name] = base_url.rstrip('/') + value[len(host):]
+                break
+    return type(f'Mock_{cls.__name__}', (cls,), attrs)
+
+async def wait_until(predicate: Callable[[], bool], timeout: float = 10):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(0.005)
+
+async def bench_kktix(browser, base_url: str, setting: Setting, runs: int) -> List[float]:
+    event_url = mock_url(base_url, f'/events/{EVENT_ID}/registrations/new')
+    setting.kktix_args.event_page = event_url
+    setting.kktix_args.ticket_name = '全票'
+    setting.kktix_args.num_of_ticket = 2
+
+    flow: Ticket_Flow = mock_flow(Ticket_Flow_KKTix, base_url)(browser.main_tab, setting)
+    await flow.start()
+    latencies = list()
+    try:
+        for i in range(runs):
+            flow.showStatus = None
+            await flow.page.get(event_url)
+            await wait_until(lambda: flow.showStatus is not None)
+
+            start = time.perf_counter()
+            ok = await flow.get_ticket()
+            elapsed = time.perf_counter() - start
+            print(f'run {i}: {"order page" if ok else "failed"} in {elapsed * 1000:.1f} ms')
+            if ok:
+                latencies.append(elapsed)
+    finally:
+        await flow.close()
+    return latencies
+
+async def bench_kham(browser, base_url: str, setting: Setting, runs: int, timeout: float) -> List[float]:
+    performance_url = mock_url(base_url, f'/application/utk02/utk0201_.aspx?PERFORMANCE_ID={PERFORMANCE_ID}')
+    setting.auto_login = True
+    setting.user_info.account = 'mock'
+    setting.user_info.password = 'mock'
+
+    flow: Ticket_Flow = mock_flow(Ticket_Flow_Kham, base_url)(browser.main_tab, setting)
+    start = time.perf_counter()
+    await flow.start() # warm up OCR + login
+    print(f'start + auto login: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    latencies = list()
+    try:
+        for i in range(runs):
+            await flow.page.get(performance_url)
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(flow.get_ticket(), timeout)
+                await wait_until(lambda: '/cart' in flow.page.target.url)
+            except asyncio.TimeoutError:
+                print(f'run {i}: timeout')
+                continue
+            elapsed = time.perf_counter() - start
+            print(f'run {i}: cart page in {elapsed * 1000:.1f} ms')
+            latencies.append(elapsed)
+    finally:
+        await flow.close()
+    return latencies
+
+async def bench(args: argparse.Namespace):
+    server = Mock_Server(scenario_from_args(args))
+    runner, base_url = await server.start()
+    browser = await uc.start(headless=args.headless)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            setting = Setting(setting_path=pathlib.Path(tmp) / 'setting.json', ticket_web=args.site)
+            if args.site == 'kktix':
+                latencies = await bench_kktix(browser, base_url, setting, args.runs)
+            else:
+                latencies = await bench_kham(browser, base_url, setting, args.runs, args.timeout)
+    finally:
+        browser.stop()
+        await runner.cleanup()
+
+    print(f'server requests: {server.stats}')
+    print(summary(f'{args.site} trigger -> order page', latencies))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the purchase flows against the mock server')
+    parser.add_argument('site', choices=['kktix', 'kham'])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per Kham run')
+    parser.add_argument('--headless', action='store_true')
+    scenario_arguments(parser)
+    args = parser.parse_args()
+    uc.loop().run_until_complete(bench(args))
+
+if __name__ == '__main__':
+    main()
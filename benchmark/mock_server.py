@@ -0,0 +1,274 @@
+'''
+Local stand-in for kktix.com / queue.kktix.com and the Kham login / captcha pages
+
+    python -m benchmark.mock_server [--port 8080] [--latency 0.05] [--failure-rate 0.1] [--sold-out]
+'''
+import argparse
+import io
+import json
+import random
+import secrets
+import string
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from typing import Dict, Tuple
+
+import asyncio
+import PIL.Image
+import PIL.ImageDraw
+from aiohttp import web
+
+EVENT_ID = 'mock-event'
+KHAM_MEMBER_COOKIE = 'KHAM_MEMBER' # only set by a successful login, unlike ASP.NET_SessionId
+PERFORMANCE_ID = 'P0001'
+
+@dataclass
+class Scenario:
+    latency: float = 0.03 # seconds added to every response
+    jitter: float = 0.02 # uniform extra latency
+    failure_rate: float = 0 # probability of a 503 on the queue POST
+    sold_out: bool = False
+    queue_polls: int = 2 # token polls before the order page id is ready
+    captcha_type: int = 0
+    sale_delay: float = 0 # seconds from server start until the tickets open
+    tickets: Dict[str, int] = field(default_factory=lambda: {'全票': 100, '優待票': 20})
+
+class Mock_Server:
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self.start_at = datetime.now(timezone.utc) + timedelta(seconds=scenario.sale_delay)
+        self.tokens: Dict[str, int] = dict() # queue token -> polls left
+        self.captcha = '' # answer of the latest Kham captcha
+        self.stats: Dict[str, int] = dict()
+
+    def reset(self):
+        self.tokens.clear()
+        self.stats.clear()
+
+    # helpers
+    def count(self, name: str):
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    async def delay(self):
+        await asyncio.sleep(self.scenario.latency + random.uniform(0, self.scenario.jitter))
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        await self.delay()
+        response = await handler(request)
+        response.headers['Date'] = formatdate(time.time(), usegmt=True)
+        return response
+
+    def inventory(self) -> dict:
+        started = datetime.now(timezone.utc) >= self.start_at
+        status = 'SOLD_OUT' if self.scenario.sold_out else 'IN_STOCK' if started else 'COMING_SOON'
+        quantity = lambda q: 0 if self.scenario.sold_out else q
+        return dict(
+            registerStatus=status,
+            ticketInventory={str(i): quantity(q) for i, q in enumerate(self.scenario.tickets.values(), 1)},
+            hasPending={str(i): False for i in range(1, len(self.scenario.tickets) + 1)},
+        )
+
+    # KKTIX
+    async def home(self, request: web.Request):
+        logout = '<a href="/logout">登出</a>' if KHAM_MEMBER_COOKIE in request.cookies else ''
+        return web.Response(text=f'<html><body>mock{logout}</body></html>', content_type='text/html')
+
+    async def registration_page(self, request: web.Request):
+        script = 'window.inventory = {inventory: %s}; window.TIXGLOBAL = {pageInfo: {recaptcha: %s}};' % (
+            json.dumps(self.inventory()),
+            json.dumps(dict(sitekeyNormal='mock-normal', sitekeyAdvanced='mock-advanced')),
+        )
+        response = web.Response(text=f'<html><head><script>{script}</script></head><body>registration</body></html>', content_type='text/html')
+        response.set_cookie('user_id_v2', 'mock-user')
+        response.set_cookie('XSRF-TOKEN', 'mock-xsrf')
+        return response
+
+    async def base_info(self, request: web.Request):
+        end_at = self.start_at + timedelta(days=1)
+        tickets = [dict(
+            id=i,
+            name=name,
+            price=dict(cents=100000, currency='TWD'),
+            start_at=self.start_at.isoformat(),
+            end_at_for_registration=end_at.isoformat(),
+        ) for i, name in enumerate(self.scenario.tickets, 1)]
+        return web.json_response(dict(eventData=dict(event=dict(captcha_type=self.scenario.captcha_type), tickets=tickets)))
+
+    async def register_info(self, request: web.Request):
+        body = json.dumps(dict(inventory=self.inventory(), ktx_captcha=dict(question='mock question?')))
+        etag = f'"{hash(body) & 0xffffffff:x}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    async def queue(self, request: web.Request):
+        self.count('queue')
+        if request.query.get('authenticity_token') != 'mock-xsrf':
+            return web.json_response(dict(error='invalid token'), status=422)
+        if random.random() < self.scenario.failure_rate:
+            return web.json_response(dict(error='busy'), status=503, headers={'Retry-After': '0.2'})
+        if self.scenario.sold_out or datetime.now(timezone.utc) < self.start_at:
+            return web.json_response(dict(result='TICKET_SOLD_OUT'), status=200)
+        token = secrets.token_hex(8)
+        self.tokens[token] = self.scenario.queue_polls
+        return web.json_response(dict(token=token))
+
+    async def queue_token(self, request: web.Request):
+        self.count('token')
+        token = request.match_info['token']
+        if token not in self.tokens:
+            return web.json_response(dict(error='not found'), status=404)
+        if self.tokens[token] > 0:
+            self.tokens[token] -= 1
+            return web.json_response(dict(position=self.tokens[token] * 10))
+        return web.json_response(dict(to_param=f'order-{token}'))
+
+    async def order_page(self, request: web.Request):
+        self.count('order_page')
+        return web.Response(text=f'<html><body>order {request.match_info["param"]}</body></html>', content_type='text/html')
+
+    # Kham
+    async def kham_login_page(self, request: web.Request):
+        response = web.Response(text=KHAM_LOGIN_HTML, content_type='text/html')
+        if 'ASP.NET_SessionId' not in request.cookies: # every visitor gets one
+            response.set_cookie('ASP.NET_SessionId', secrets.token_hex(12))
+        return response
+
+    async def kham_login(self, request: web.Request):
+        data = await request.post()
+        post = json.loads(data.get('post', '{}'))
+        self.count('kham_login')
+        ok = post.get('CHK', '').upper() == self.captcha
+        response = web.json_response(dict(ok=ok))
+        if ok:
+            response.set_cookie(KHAM_MEMBER_COOKIE, secrets.token_hex(8))
+        return response
+
+    async def kham_captcha(self, request: web.Request):
+        self.count('captcha')
+        self.captcha = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
+        img = PIL.Image.new('RGB', (100, 30), 'white')
+        PIL.ImageDraw.Draw(img).text((30, 8), self.captcha, fill='black')
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        return web.Response(body=buffer.getvalue(), content_type='image/png')
+
+    async def kham_performance(self, request: web.Request):
+        return web.Response(text=KHAM_PERFORMANCE_HTML, content_type='text/html')
+
+    async def kham_cart(self, request: web.Request):
+        data = await request.post()
+        self.count('cart')
+        ok = data.get('CHK', '').upper() == self.captcha and not self.scenario.sold_out
+        return web.json_response(dict(ok=ok))
+
+    async def kham_cart_done(self, request: web.Request):
+        return web.Response(text='<html><body>cart</body></html>', content_type='text/html')
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/', self.home)
+        app.router.add_get('/events/{event}/registrations/new', self.registration_page)
+        app.router.add_get('/events/{event}/registrations/{param}', self.order_page)
+        app.router.add_get('/g/events/{event}/base_info', self.base_info)
+        app.router.add_get('/g/events/{event}/register_info', self.register_info)
+        app.router.add_post('/queue/{event}', self.queue)
+        app.router.add_get('/queue/token/{token}', self.queue_token)
+        app.router.add_get('/application/utk13/utk1306_.aspx', self.kham_login_page)
+        app.router.add_post('/Application/UTK13/UTK1306_.aspx', self.kham_login)
+        app.router.add_get('/pic.aspx', self.kham_captcha)
+        app.router.add_get('/application/utk02/utk0201_.aspx', self.kham_performance)
+        app.router.add_post('/cart', self.kham_cart)
+        app.router.add_get('/cart', self.kham_cart_done)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> Tuple[web.AppRunner, str]:
+        runner = web.AppRunner(self.create_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = runner.addresses[0][1]
+        return runner, f'http://{host}:{port}/'
+
+KHAM_SCRIPT = '''
+function refreshCaptcha() {
+    const img = document.querySelector('img');
+    img.src = img.src.split('&_=')[0] + '&_=' + Date.now();
+}
+function rejected() {
+    // the real site alerts a wrong captcha, the flow takes the dialog as the rejection
+    alert('驗證碼錯誤');
+    refreshCaptcha();
+}
+'''
+
+KHAM_LOGIN_HTML = '''<html><head><script>%s
+function hideProcess() {}
+function DoPost(data, url, callback) {
+    fetch(url, {method: 'POST', headers: {'Content-Type': 'application/x-www-form-urlencoded'}, body: data})
+        .then(r => r.json())
+        .then(r => { callback(0, r); if (r.ok) window.location = '/'; else rejected(); });
+}
+</script></head><body>
+<img src="/pic.aspx?TYPE=LOGIN"><input id="CHK">
+</body></html>''' % KHAM_SCRIPT
+
+KHAM_PERFORMANCE_HTML = '''<html><head><script>%s
+function addShoppingCart() {
+    const body = new URLSearchParams({CHK: document.querySelector('input#CHK').value});
+    fetch('/cart', {method: 'POST', body: body})
+        .then(r => r.json())
+        .then(r => { if (r.ok) window.location = '/cart?PERFORMANCE_ID=%s'; else rejected(); });
+}
+</script></head><body>
+<img src="/pic.aspx?TYPE=CART"><input id="CHK">
+</body></html>''' % (KHAM_SCRIPT, PERFORMANCE_ID)
+
+def mock_url(base_url: str, path: str) -> str:
+    return base_url.rstrip('/') + path
+
+def scenario_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=Scenario.latency)
+    parser.add_argument('--jitter', type=float, default=Scenario.jitter)
+    parser.add_argument('--failure-rate', type=float, default=Scenario.failure_rate)
+    parser.add_argument('--sold-out', action='store_true')
+    parser.add_argument('--queue-polls', type=int, default=Scenario.queue_polls)
+    parser.add_argument('--captcha-type', type=int, default=Scenario.captcha_type)
+    parser.add_argument('--sale-delay', type=float, default=Scenario.sale_delay)
+
+def scenario_from_args(args: argparse.Namespace) -> Scenario:
+    return Scenario(
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        sold_out=args.sold_out,
+        queue_polls=args.queue_polls,
+        captcha_type=args.captcha_type,
+        sale_delay=args.sale_delay,
+    )
+
+async def serve(scenario: Scenario, port: int):
+    runner, base_url = await Mock_Server(scenario).start(port=port)
+    print(f'KKTIX event page: {mock_url(base_url, f"/events/{EVENT_ID}/registrations/new")}')
+    print(f'Kham login page: {mock_url(base_url, "/application/utk13/utk1306_.aspx")}')
+    print(f'Kham performance page: {mock_url(base_url, f"/application/utk02/utk0201_.aspx?PERFORMANCE_ID={PERFORMANCE_ID}")}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the mock ticketing server')
+    parser.add_argument('--port', type=int, default=8080)
+    scenario_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(scenario_from_args(args), args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
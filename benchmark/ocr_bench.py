@@ -0,0 +1,58 @@
+'''
+OCR throughput benchmark
+
+    python -m benchmark.ocr_bench <image folder> [--workers 2] [--rounds 3]
+'''
+import argparse
+import pathlib
+import time
+
+import asyncio
+
+from core.ocr import OCR_Service
+from .report import summary
+
+IMAGE_SUFFIX = {'.png', '.jpg', '.jpeg', '.gif', '.bmp'}
+
+async def bench(folder: pathlib.Path, workers: int, rounds: int):
+    images = [p.read_bytes() for p in sorted(folder.iterdir()) if p.suffix.lower() in IMAGE_SUFFIX]
+    if not images:
+        print(f'No images in {folder}')
+        return
+
+    ocr = OCR_Service(workers=workers, cache_size=0) # every round decodes again
+    start = time.perf_counter()
+    await ocr.warm_up()
+    print(f'warm up {workers} worker(s): {time.perf_counter() - start:.2f} s')
+
+    latencies = list()
+    confidences = list()
+    async def solve(img):
+        t = time.perf_counter()
+        res = await ocr.solve(img)
+        latencies.append(time.perf_counter() - t)
+        if res is not None:
+            confidences.append(res.confidence)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[solve(img) for img in images])
+    total = time.perf_counter() - start
+    ocr.close()
+
+    print(f'{len(latencies)} solves ({len(confidences)} with a {ocr.length} character answer) in {total:.2f} s')
+    if confidences:
+        print(f'confidence: min {min(confidences):.2f}, mean {sum(confidences) / len(confidences):.2f}')
+    print(f'throughput: {len(latencies) / total:.1f} solves/s')
+    print(summary('latency', latencies))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the captcha OCR service')
+    parser.add_argument('folder', type=pathlib.Path)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(bench(args.folder, args.workers, args.rounds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''
+Handler latency of a flow fed with a recorded trace (python main.py --record trace.jsonl.gz)
+
+    python -m benchmark.replay_bench <trace> kktix|kham [--speed 1] [--runs 3]
+'''
+import argparse
+import pathlib
+import tempfile
+
+import asyncio
+
+from core.metrics import metrics
+from core.setting import Setting
+from core.ticket_flow import get_ticket_flow_class
+from core.trace import Trace_Replay
+from core.utils import TICKET_WEB
+from .report import summary
+
+async def replay(trace: pathlib.Path, site: str, speed: float, runs: int):
+    metrics.enable()
+    with tempfile.TemporaryDirectory() as tmp:
+        setting = Setting(setting_path=pathlib.Path(tmp) / 'setting.json', ticket_web=site)
+        flow_class = get_ticket_flow_class(TICKET_WEB[site.upper()])
+        await flow_class.preload()
+
+        latencies = dict()
+        for i in range(runs):
+            trace_replay = Trace_Replay(trace, speed)
+            flow = flow_class(trace_replay.page, setting)
+            if hasattr(flow, 'http'):
+                trace_replay.attach_http(flow.http)
+            if hasattr(flow, 'event_cache'): # every run starts cold
+                flow.event_cache.directory = pathlib.Path(tmp) / f'cache_{i}'
+            elapsed = await trace_replay.run()
+            print(f'run {i}: {len(trace_replay.events)} events in {elapsed:.2f} s')
+            for name, values in trace_replay.latencies.items():
+                latencies.setdefault(name, list()).extend(values)
+            await flow.close()
+
+    print('== handlers')
+    for name, values in sorted(latencies.items()):
+        print(summary(f'  {name}', values))
+    print('== spans')
+    for name, h in metrics.snapshot().items():
+        print(f'  {name}: n={h["count"]} mean {h["mean"] * 1000:.1f} ms, p90 {h["p90"] * 1000:.1f}, max {h["max"] * 1000:.1f}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded trace into a ticket flow')
+    parser.add_argument('trace', type=pathlib.Path)
+    parser.add_argument('site', choices=['kktix', 'kham'])
+    parser.add_argument('--speed', type=float, default=1, help='replay pace, 0 dispatches as fast as possible')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(replay(args.trace, args.site, args.speed, args.runs))
+
+if __name__ == '__main__':
+    main()
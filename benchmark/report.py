@@ -0,0 +1,16 @@
+import statistics
+from typing import Sequence
+
+def percentile(values: Sequence[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summary(name: str, seconds: Sequence[float]) -> str:
+    '''
+    one line latency distribution, values in seconds, printed in ms
+    '''
+    if not seconds:
+        return f'{name}: no samples'
+    ms = [s * 1000 for s in seconds]
+    return f'{name}: n={len(ms)} mean {statistics.mean(ms):.1f} ms, min {min(ms):.1f}, ' +\
+        f'p50 {percentile(ms, 50):.1f}, p90 {percentile(ms, 90):.1f}, p99 {percentile(ms, 99):.1f}, max {max(ms):.1f}'
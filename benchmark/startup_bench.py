@@ -0,0 +1,69 @@
+'''
+Cold start time per site, every run is a fresh interpreter
+
+    python -m benchmark.startup_bench [--runs 5] [--browser]
+'''
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from core.utils import TICKET_WEB
+from .report import summary
+
+STARTUP_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import asyncio
+from core.ticket_flow import get_ticket_flow_class
+from core.utils import TICKET_WEB
+import_core = time.perf_counter()
+flow_class = get_ticket_flow_class(TICKET_WEB[sys.argv[1]])
+import_flow = time.perf_counter()
+
+async def ready():
+    preload = asyncio.create_task(flow_class.preload())
+    browser = None
+    if sys.argv[2] == '1':
+        import nodriver as uc
+        browser = await uc.start(headless=True)
+    await preload
+    if browser is not None:
+        browser.stop()
+asyncio.run(ready())
+done = time.perf_counter()
+
+print(json.dumps(dict(
+    import_core=import_core - start,
+    import_flow=import_flow - import_core,
+    preload=done - import_flow,
+    modules=len(sys.modules),
+    heavy=[m for m in ('aiohttp', 'ddddocr', 'onnxruntime', 'PIL', 'keyboard') if m in sys.modules],
+)))
+'''
+
+def run_once(web: TICKET_WEB, browser: bool) -> dict:
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_CODE, web.name, '1' if browser else '0'],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total'] = time.perf_counter() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of each ticket site')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--browser', action='store_true', help='launch the browser alongside the preload, like main.py')
+    args = parser.parse_args()
+
+    for web in TICKET_WEB:
+        results = [run_once(web, args.browser) for _ in range(args.runs)]
+        print(f'== {web.name}: {results[-1]["modules"]} modules, heavy imports {results[-1]["heavy"]}')
+        for key in ('import_core', 'import_flow', 'preload', 'total'):
+            print(summary(f'  {key}', [r[key] for r in results]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pathlib
+import sys
+import tempfile
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+import asyncio
+
+__all__ = ['Captcha_Answer_Store']
+
+logger = logging.getLogger(__name__)
+
+Solver = Callable[[str], Union[Optional[str], Awaitable[Optional[str]]]]
+
+class Captcha_Answer_Store:
+    '''
+    Answers of KKTIX custom captcha questions per event id + question hash, kept on disk.
+    Filled before the sale by the registered solvers, then by manual entry on the terminal.
+    '''
+    def __init__(self, path: Union[str, pathlib.Path] = './cache/captcha_answers.json', prompt: bool = True):
+        self.path = pathlib.Path(path)
+        self.prompt = prompt
+        self.solvers: List[Solver] = list()
+        self.answers: Dict[str, dict] = dict()
+        self._prompts: Dict[str, asyncio.Task] = dict()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.answers = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Invalid captcha answers {self.path}: {e!r}')
+
+    @staticmethod
+    def key(event_id: str, question: str) -> str:
+        return f'{event_id}:{hashlib.sha1(question.strip().encode("utf-8")).hexdigest()[:16]}'
+
+    def add_solver(self, solver: Solver):
+        '''
+        `solver(question)` returns the answer or None, plain or coroutine function
+        '''
+        self.solvers.append(solver)
+
+    def get(self, event_id: str, question: str) -> Optional[str]:
+        answer = self.answers.get(self.key(event_id, question))
+        return None if answer is None else answer['answer']
+
+    def set(self, event_id: str, question: str, answer: str, source: str = 'manual'):
+        self.answers[self.key(event_id, question)] = dict(
+            question=question, answer=answer, source=source, saved_at=time.time(),
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # orchestrator workers share the file, each save writes its own temp file
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.path.parent, prefix=self.path.name, suffix='.tmp', delete=False) as f:
+            json.dump(self.answers, f, ensure_ascii=False, indent=4)
+        os.replace(f.name, self.path)
+        logger.info(f'Captcha answer of {event_id} "{question}": {answer} ({source})')
+
+    @staticmethod
+    def __read_line() -> Optional[str]:
+        # raw reads of fd 0, a daemon thread blocked in sys.stdin would hold its lock at exit
+        line = b''
+        while not line.endswith(b'\n'):
+            chunk = os.read(0, 1024)
+            if not chunk: # no terminal, e.g. an orchestrator worker
+                return None if not line else line.decode(sys.stdin.encoding or 'utf-8', errors='replace')
+            line += chunk
+        return line.decode(sys.stdin.encoding or 'utf-8', errors='replace')
+
+    async def __ask(self, question: str) -> Optional[str]:
+        # the prompt can't be interrupted, a daemon thread instead of the default executor
+        # which asyncio.run would wait for on exit
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def ask():
+            print(f'KKTIX captcha "{question}", answer: ', end='', flush=True)
+            try:
+                answer = (self.__read_line() or '').strip() or None
+            except OSError:
+                answer = None
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(answer))
+        threading.Thread(target=ask, name='captcha_prompt', daemon=True).start()
+        return await future
+
+    async def prepare(self, event_id: str, question: str) -> Optional[str]:
+        '''
+        stored answer, else the first solver answer, else ask on the terminal
+        '''
+        if (answer := self.get(event_id, question)) is not None:
+            return answer
+
+        for solver in self.solvers:
+            try:
+                answer = solver(question)
+                if inspect.isawaitable(answer):
+                    answer = await answer
+            except Exception as e:
+                logger.error(f'Captcha solver {solver!r} failed: {e!r}')
+                continue
+            if answer:
+                self.set(event_id, question, answer, source=getattr(solver, '__name__', 'solver').strip('_'))
+                return answer
+
+        if not self.prompt:
+            return None
+        # one prompt per question, page reloads wait for the same one
+        key = self.key(event_id, question)
+        if key not in self._prompts:
+            self._prompts[key] = asyncio.create_task(self.__ask(question), name='captcha_prompt')
+        answer = await asyncio.shield(self._prompts[key])
+        if answer and self.get(event_id, question) is None:
+            self.set(event_id, question, answer, source='manual')
+        return answer
+
+    def close(self):
+        for task in self._prompts.values():
+            task.cancel()
+        self._prompts.clear()
@@ -0,0 +1,199 @@
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import asyncio
+
+from .http_client import Http_Client
+
+__all__ = [
+    'Server_Clock',
+    'Sale_Scheduler',
+    'Schedule_Report',
+]
+
+logger = logging.getLogger(__name__)
+
+class Server_Clock:
+    '''
+    Estimate `server time - local time` from the `Date` header of responses.
+    `Date` only has one second resolution, every sample bounds the offset to
+    [date - received, date + 1 - sent], samples are spread over the second so
+    the intersection of the bounds narrows down to a few round trips.
+    '''
+    def __init__(self, http: Http_Client, url: str):
+        self.http = http
+        self.url = url
+        self.offset = 0.0 # seconds, server - local
+        self.uncertainty: Optional[float] = None # seconds, None before sync
+        self.latency = 0.0 # seconds, shortest one way trip seen by the last sync
+
+    @property
+    def synced(self) -> bool:
+        return self.uncertainty is not None
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(time.time() + self.offset, timezone.utc)
+
+    def to_local(self, server_time: datetime) -> float:
+        '''
+        convert server datetime to local `time.time()` timestamp
+        '''
+        return server_time.timestamp() - self.offset
+
+    async def __sample(self) -> Optional[Tuple[float, float, float]]:
+        sent = time.time()
+        response = await self.http.request('HEAD', self.url)
+        received = time.time()
+        date = response.headers.get('Date')
+        if date is None:
+            return None
+        return sent, received, parsedate_to_datetime(date).timestamp()
+
+    async def sync(self, samples: int = 10) -> float:
+        bounds: List[Tuple[float, float]] = list()
+        midpoints: List[float] = list()
+        trips: List[float] = list()
+        for i in range(samples):
+            try:
+                sample = await self.__sample()
+            except Exception as e:
+                logger.warning(f'Clock sample failed: {e!r}')
+                continue
+            if sample is None:
+                logger.warning(f'No Date header from {self.url}')
+                break
+
+            sent, received, date = sample
+            bounds.append((date - received, date + 1 - sent))
+            midpoints.append(date + 0.5 - (sent + received) / 2)
+            trips.append(received - sent)
+            # shift the next sample into another part of the second
+            await asyncio.sleep(((i + 1) / samples - time.time() % 1) % 1)
+
+        if not bounds:
+            logger.error('Clock sync failed, use local time')
+            return self.offset
+
+        self.latency = min(trips) / 2
+        low = max(b[0] for b in bounds)
+        high = min(b[1] for b in bounds)
+        if low <= high:
+            self.offset = (low + high) / 2
+            self.uncertainty = (high - low) / 2
+        else: # inconsistent samples (server jitter), fall back to the median
+            midpoints.sort()
+            self.offset = midpoints[len(midpoints) // 2]
+            self.uncertainty = 0.5
+        logger.debug(f'Server clock offset {self.offset * 1000:+.1f} ms (±{self.uncertainty * 1000:.1f} ms, {len(bounds)} samples)')
+        return self.offset
+
+@dataclass
+class Schedule_Report:
+    target: datetime
+    offset: float
+    uncertainty: Optional[float]
+    error: float # fired - target in local clock, seconds
+    spin: float # seconds spent spinning
+    bias: float = 0.0 # seconds fired after the target estimate
+
+    def __repr__(self):
+        uncertainty = 'unsynced' if self.uncertainty is None else f'±{self.uncertainty * 1000:.1f} ms'
+        return f'[Schedule] fired {self.error * 1000:+.3f} ms from {self.target.isoformat()} + {self.bias * 1000:.1f} ms bias, '+\
+            f'clock offset {self.offset * 1000:+.1f} ms ({uncertainty}), spin {self.spin * 1000:.1f} ms'
+
+class Sale_Scheduler:
+    '''
+    Fire a coroutine at a server time: coarse asyncio sleep then a short busy spin.
+    The fire time is pushed back by the clock uncertainty so the request doesn't reach
+    the server before the target, answers coming back before the start are retried up to `retry_until`.
+    '''
+    def __init__(
+        self,
+        clock: Server_Clock,
+        spin: float = 0.02,
+        resync_before: float = 30,
+        prepare: Optional[Callable[[], Awaitable]] = None,
+        max_bias: float = 0.25,
+        retry_margin: float = 0.5,
+        retry_pause: float = 0.2,
+    ):
+        self.clock = clock
+        self.spin = spin
+        self.resync_before = resync_before
+        self.prepare = prepare # e.g. re-warm connections after the last resync
+        self.max_bias = max_bias
+        self.retry_margin = retry_margin
+        self.retry_pause = retry_pause
+        self.reports: List[Schedule_Report] = list()
+
+    @property
+    def bias(self) -> float:
+        '''
+        seconds to fire after the target estimate: the uncertainty less the one way trip to the server
+        '''
+        if self.clock.uncertainty is None:
+            return 0.0
+        return min(self.max_bias, max(0.0, self.clock.uncertainty - self.clock.latency))
+
+    def retry_until(self, target: datetime) -> datetime:
+        '''
+        server time until which a 'not started' answer may come from firing early
+        '''
+        return target + timedelta(seconds=2 * (self.clock.uncertainty or 0.5) + self.retry_margin)
+
+    def retry_delay(self) -> float:
+        '''
+        jittered pause between retries of a 'not started' answer, spreads them over the uncertainty window
+        '''
+        return random.uniform(0.5, 1.5) * self.retry_pause
+
+    async def wait_until(self, target: datetime) -> Schedule_Report:
+        if target.tzinfo is None:
+            target = target.replace(tzinfo=timezone.utc)
+
+        if not self.clock.synced:
+            await self.clock.sync()
+
+        # re-sync once close to the target, long waits drift
+        lead = self.clock.to_local(target) - time.time() - self.resync_before
+        if lead > 0:
+            await asyncio.sleep(lead)
+            await self.clock.sync()
+            if self.prepare is not None:
+                await self.prepare()
+
+        bias = self.bias
+        # coarse sleep
+        remaining = self.clock.to_local(target) + bias - time.time()
+        if remaining > self.spin:
+            await asyncio.sleep(remaining - self.spin)
+
+        # spin for the final milliseconds, perf_counter is monotonic and precise
+        spin_start = time.perf_counter()
+        deadline = spin_start + (self.clock.to_local(target) + bias - time.time())
+        while time.perf_counter() < deadline:
+            pass
+        fired = time.perf_counter()
+
+        report = Schedule_Report(
+            target=target,
+            offset=self.clock.offset,
+            uncertainty=self.clock.uncertainty,
+            error=fired - deadline,
+            spin=fired - spin_start,
+            bias=bias,
+        )
+        self.reports.append(report)
+        return report
+
+    async def run_at(self, target: datetime, func: Callable[[], Awaitable]):
+        report = await self.wait_until(target)
+        try:
+            return await func()
+        finally:
+            logger.info(report)
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import time
+from typing import Dict, Optional, Union
+
+__all__ = ['Event_Cache']
+
+logger = logging.getLogger(__name__)
+
+class Event_Cache:
+    '''
+    Static event metadata (ticket definitions, captcha question...) per event id,
+    kept in memory and on disk so page reloads and restarts skip the fetch.
+    '''
+    def __init__(
+        self,
+        site: str,
+        ttl: float = 30 * 60,
+        directory: Union[str, pathlib.Path] = './cache',
+    ):
+        self.site = site
+        self.ttl = ttl
+        self.directory = pathlib.Path(directory)
+        self.memory: Dict[str, dict] = dict()
+
+    def path(self, event_id: str) -> pathlib.Path:
+        return self.directory / f'{self.site}_{re.sub(r"[^0-9A-Za-z_-]", "_", event_id)}.json'
+
+    def load(self, event_id: str) -> Optional[dict]:
+        '''
+        cached data of `event_id`, None when missing or older than the ttl
+        '''
+        cache = self.memory.get(event_id)
+        if cache is None:
+            path = self.path(event_id)
+            if not path.exists():
+                return None
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Invalid event cache {path}: {e!r}')
+                return None
+            self.memory[event_id] = cache
+
+        if time.time() - cache.get('saved_at', 0) > self.ttl:
+            logger.debug(f'Event cache of {event_id} expired')
+            self.memory.pop(event_id, None)
+            return None
+        return cache['data']
+
+    def save(self, event_id: str, data: dict):
+        cache = dict(saved_at=time.time(), data=data)
+        self.memory[event_id] = cache
+        path = self.path(event_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # workers of the orchestrator save the same event at once, each one writes its own temp file
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=path.parent, prefix=path.name, suffix='.tmp', delete=False) as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(f.name, path)
+
+    def clear(self, event_id: str):
+        self.memory.pop(event_id, None)
+        self.path(event_id).unlink(missing_ok=True)
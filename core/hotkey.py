@@ -0,0 +1,86 @@
+import logging
+import time
+from typing import Awaitable, Callable, List
+
+import asyncio
+
+from .metrics import metrics
+__all__ = ['Hotkey_Trigger']
+
+logger = logging.getLogger(__name__)
+
+class Hotkey_Trigger:
+    '''
+    Push key-down events from the keyboard hook thread into an asyncio queue.
+    Auto-repeat of a held key is ignored and only one purchase runs at a time.
+    '''
+    def __init__(
+        self,
+        key: str,
+        callback: Callable[[], Awaitable],
+        can_fire: Callable[[], bool] = lambda: True,
+        debounce: float = 0.3,
+    ):
+        self.key = key
+        self.callback = callback
+        self.can_fire = can_fire
+        self.debounce = debounce
+        self.latencies: List[float] = list() # key-down to callback, seconds
+
+        self._queue: asyncio.Queue = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._hooks = list()
+        self._held = False
+        self._last_fired = 0.0
+
+    def __on_key_down(self, event):
+        # runs in keyboard's hook thread
+        if self._held: # auto repeat
+            return
+        self._held = True
+        now = time.perf_counter()
+        if now - self._last_fired < self.debounce:
+            return
+        self._last_fired = now
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, now)
+
+    def __on_key_up(self, event):
+        self._held = False
+
+    def start(self):
+        import keyboard # only runs that use the hotkey need the keyboard hook
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._hooks = [
+            keyboard.on_press_key(self.key, self.__on_key_down),
+            keyboard.on_release_key(self.key, self.__on_key_up),
+        ]
+
+    def stop(self):
+        import keyboard
+        for hook in self._hooks:
+            keyboard.unhook(hook)
+        self._hooks.clear()
+
+    async def run(self, stopped: Callable[[], bool]):
+        self.start()
+        try:
+            while not stopped():
+                try:
+                    pressed_at = await asyncio.wait_for(self._queue.get(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                if not self.can_fire():
+                    continue
+
+                latency = time.perf_counter() - pressed_at
+                self.latencies.append(latency)
+                metrics.observe('hotkey.latency', latency)
+                logger.debug(f'Hotkey {self.key!r} -> purchase in {latency * 1000:.3f} ms')
+                await self.callback()
+
+                # drop presses queued while the purchase was in flight
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+        finally:
+            self.stop()
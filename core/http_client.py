@@ -0,0 +1,161 @@
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from http.cookies import SimpleCookie
+from typing import Dict, Iterable, List, Mapping, Optional
+from urllib.parse import urlsplit
+
+import asyncio
+import aiohttp
+from yarl import URL
+
+__all__ = [
+    'Http_Client',
+    'Http_Response',
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Http_Response:
+    url: str
+    status: int
+    body: bytes
+    headers: Mapping[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def status_code(self) -> int:
+        return self.status
+
+    @property
+    def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+class Http_Client:
+    '''
+    Keep-alive HTTP client shared by every request of a flow.
+    aiohttp keeps one connection pool per host, `warm_up` opens (and TLS handshakes)
+    those connections ahead of time so the purchase requests reuse them.
+    '''
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+
+    def __init__(
+        self,
+        hosts: Iterable[str],
+        limit_per_host: int = 4,
+        timeout: float = 10,
+        keepalive: float = 120,
+    ):
+        self.hosts = [self.__origin(h) for h in hosts]
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.keepalive = keepalive
+        self.cookies: Dict[str, str] = dict()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @staticmethod
+    def __origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}/'
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=600,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={'User-Agent': self.USER_AGENT},
+            )
+            # cookies set before the session existed
+            if self.cookies:
+                self._session.cookie_jar.update_cookies(self.cookies)
+        return self._session
+
+    async def warm_up(self, connections: int = 1):
+        '''
+        open `connections` keep-alive connections to every host
+        '''
+        connections = min(connections, self.limit_per_host)
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[self.request('HEAD', host) for host in self.hosts for _ in range(connections)],
+            return_exceptions=True
+        )
+        for host, res in zip([h for h in self.hosts for _ in range(connections)], results):
+            if isinstance(res, Exception):
+                logger.warning(f'Warm up {host} failed: {res!r}')
+        logger.debug(f'Warm up {len(self.hosts)} host(s) in {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    def set_cookies(self, cookies: Dict[str, str]):
+        # cookies without domain are sent to every host (kktix.com & queue.kktix.com)
+        self.cookies.update(cookies)
+        self.session.cookie_jar.update_cookies(cookies)
+
+    def cookie_values(self) -> Dict[str, str]:
+        return {morsel.key: morsel.value for morsel in self.session.cookie_jar}
+
+    def import_cookies(self, cookies: List[dict]):
+        '''
+        cookies in the Session_Cache format, each one scoped to its own domain
+        '''
+        for c in cookies:
+            cookie = SimpleCookie()
+            cookie[c['name']] = c['value']
+            morsel = cookie[c['name']]
+            morsel['path'] = c.get('path') or '/'
+            if c.get('domain'):
+                morsel['domain'] = c['domain']
+            if c.get('secure'):
+                morsel['secure'] = True
+            if c.get('httpOnly'):
+                morsel['httponly'] = True
+            domain = (c.get('domain') or '').lstrip('.')
+            self.session.cookie_jar.update_cookies(cookie, URL(f'https://{domain}/') if domain else URL())
+
+    def export_cookies(self) -> List[dict]:
+        '''
+        cookies of the jar in the Session_Cache format
+        '''
+        return [dict(
+            name=morsel.key,
+            value=morsel.value,
+            domain=morsel['domain'] or None,
+            path=morsel['path'] or '/',
+            expires=-1,
+            secure=bool(morsel['secure']),
+            httpOnly=bool(morsel['httponly']),
+            sameSite=None,
+        ) for morsel in self.session.cookie_jar]
+
+    async def request(self, method: str, url: str, **kwargs) -> Http_Response:
+        start = time.perf_counter()
+        async with self.session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            return Http_Response(
+                url=str(response.url),
+                status=response.status,
+                body=body,
+                headers=response.headers.copy(),
+                elapsed=time.perf_counter() - start,
+            )
+
+    async def get(self, url: str, **kwargs) -> Http_Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> Http_Response:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
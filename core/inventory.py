@@ -0,0 +1,156 @@
+import hashlib
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncio
+import aiohttp
+
+from .http_client import Http_Client
+
+__all__ = [
+    'INVENTORY_EVENT',
+    'Inventory_Event',
+    'Inventory_Monitor',
+]
+
+logger = logging.getLogger(__name__)
+
+class INVENTORY_EVENT(Enum):
+    IN_STOCK = 'in_stock' # ticketInventory 0 -> n
+    SOLD_OUT = 'sold_out' # ticketInventory n -> 0
+    QUANTITY_CHANGED = 'quantity_changed'
+    PENDING_SET = 'pending_set'
+    PENDING_CLEARED = 'pending_cleared'
+    STATUS_CHANGED = 'status_changed' # registerStatus
+
+@dataclass
+class Inventory_Event:
+    kind: INVENTORY_EVENT
+    ticket: Any # Ticket_Flow_KKTix.Ticket, None for STATUS_CHANGED
+    old: Any
+    new: Any
+
+    def __repr__(self):
+        name = '' if self.ticket is None else f' {self.ticket.name}'
+        return f'[Inventory] {self.kind.value}{name}: {self.old} -> {self.new}'
+
+class Inventory_Monitor:
+    '''
+    Poll the event inventory with conditional requests and update the
+    `ShowStatus` tickets in place, listeners receive an `Inventory_Event` per change.
+    '''
+    def __init__(
+        self,
+        http: Http_Client,
+        url: str,
+        status, # Ticket_Flow_KKTix.ShowStatus
+        interval: float = 1,
+        clock: Optional[Callable[[], datetime]] = None,
+    ):
+        self.http = http
+        self.url = url
+        self.status = status
+        self.interval = interval
+        self.clock = clock
+        self.listeners: List[Callable[[Inventory_Event], None]] = list()
+        self._validators: Dict[str, str] = dict()
+        self._digest: Optional[bytes] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, callback: Callable[[Inventory_Event], None]):
+        self.listeners.append(callback)
+
+    def apply(self, inventory: dict) -> List[Inventory_Event]:
+        '''
+        update tickets from an `inventory` dict (same shape as `inventory.inventory`)
+        '''
+        events = list()
+        register_status = inventory.get('registerStatus', self.status.registerStatus)
+        if register_status != self.status.registerStatus:
+            events.append(Inventory_Event(INVENTORY_EVENT.STATUS_CHANGED, None, self.status.registerStatus, register_status))
+            self.status.registerStatus = register_status
+
+        ticket_inventory = inventory.get('ticketInventory', {})
+        has_pending = inventory.get('hasPending', {})
+        now = self.clock() if self.clock is not None else None
+        for ticket in self.status.tickets:
+            _id = str(ticket.id)
+            if now is not None:
+                ticket.sys_time = now
+
+            quantity = ticket_inventory.get(_id, ticket.ticketInventory)
+            if quantity != ticket.ticketInventory:
+                kind = INVENTORY_EVENT.QUANTITY_CHANGED
+                if ticket.ticketInventory == 0:
+                    kind = INVENTORY_EVENT.IN_STOCK
+                elif quantity == 0:
+                    kind = INVENTORY_EVENT.SOLD_OUT
+                events.append(Inventory_Event(kind, ticket, ticket.ticketInventory, quantity))
+                ticket.ticketInventory = quantity
+
+            pending = bool(has_pending.get(_id, ticket.hasPending))
+            if pending != ticket.hasPending:
+                kind = INVENTORY_EVENT.PENDING_SET if pending else INVENTORY_EVENT.PENDING_CLEARED
+                events.append(Inventory_Event(kind, ticket, ticket.hasPending, pending))
+                ticket.hasPending = pending
+
+        for event in events:
+            logger.debug(event)
+            for callback in self.listeners:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f'Inventory listener error: {e!r}')
+        return events
+
+    async def poll(self) -> List[Inventory_Event]:
+        headers = dict()
+        if 'ETag' in self._validators:
+            headers['If-None-Match'] = self._validators['ETag']
+        if 'Last-Modified' in self._validators:
+            headers['If-Modified-Since'] = self._validators['Last-Modified']
+
+        response = await self.http.get(self.url, headers=headers)
+        if response.status == 304:
+            return []
+        if response.status != 200:
+            logger.warning(f'Inventory poll {response.status}')
+            return []
+
+        for key in ('ETag', 'Last-Modified'):
+            if key in response.headers:
+                self._validators[key] = response.headers[key]
+        # servers without validators: skip parsing identical bodies
+        digest = hashlib.blake2b(response.body, digest_size=16).digest()
+        if digest == self._digest:
+            return []
+        self._digest = digest
+
+        body = response.json()
+        inventory = body.get('inventory', body) if isinstance(body, dict) else None
+        if not isinstance(inventory, dict) or not isinstance(inventory.get('ticketInventory'), dict):
+            logger.warning(f'No inventory in {self.url}')
+            return []
+        return self.apply(inventory)
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f'Inventory poll failed: {e!r}')
+            except Exception as e: # keep watching, the flow relies on the events
+                logger.error(f'Inventory poll error: {e!r}')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(), name='inventory_monitor')
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
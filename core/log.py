@@ -0,0 +1,92 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+from typing import Optional
+
+__all__ = ['setup_logging']
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+_IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+class _Deferred_Queue_Handler(logging.handlers.QueueHandler):
+    '''
+    enqueue the record, message and traceback are formatted by the writer thread.
+    a mutable message or argument is formatted right away, the loop may change it before the writer runs
+    '''
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args.values() if isinstance(record.args, dict) else record.args or ()
+        if not isinstance(record.msg, str) or any(not isinstance(a, _IMMUTABLE) for a in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class _Listener(logging.handlers.QueueListener):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # merge the message once in the writer thread, shared by every handler
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class _Rate_Limit(logging.Filter):
+    '''
+    token bucket of `rate` records per second, reports how many were dropped once it refills
+    '''
+    def __init__(self, rate: float = 20, burst: int = 50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if record.levelno >= logging.WARNING: # never drop problems
+            return True
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        if self.dropped:
+            record.msg = f'{record.getMessage()} ({self.dropped} log records dropped)'
+            record.args = None
+            self.dropped = 0
+        return True
+
+def setup_logging(
+    name: str = 'core',
+    console_level: int = logging.DEBUG,
+    trace_path: Optional[str] = None,
+    console_rate: float = 20,
+    fmt: str = FORMAT,
+) -> logging.handlers.QueueListener:
+    '''
+    Log `name` through a queue to a background thread: the event loop only enqueues records.
+    The console is rate limited, `trace_path` keeps every DEBUG record for post-mortems.
+    '''
+    formatter = logging.Formatter(fmt, datefmt=DATE_FORMAT)
+    console = logging.StreamHandler()
+    console.setLevel(console_level)
+    console.setFormatter(formatter)
+    console.addFilter(_Rate_Limit(console_rate))
+    handlers = [console]
+    if trace_path is not None:
+        trace = logging.handlers.RotatingFileHandler(trace_path, maxBytes=64 * 2**20, backupCount=3, encoding='utf-8')
+        trace.setLevel(logging.DEBUG)
+        trace.setFormatter(formatter)
+        handlers.insert(0, trace) # before the console filter notes the dropped records
+
+    records = queue.SimpleQueue()
+    listener = _Listener(records, *handlers, respect_handler_level=True)
+    logger = logging.getLogger(name)
+    logger.addHandler(_Deferred_Queue_Handler(records))
+    logger.setLevel(logging.DEBUG if trace_path is not None else console_level)
+    listener.start()
+    atexit.register(listener.stop) # flush what is left on exit
+    return listener
@@ -0,0 +1,267 @@
+import functools
+import logging
+import pathlib
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional, Union
+
+import asyncio
+
+from .metrics import metrics
+
+__all__ = [
+    'Loop_Monitor',
+    'Sampling_Profiler',
+]
+
+logger = logging.getLogger(__name__)
+
+def _where(code, lineno: int) -> str:
+    return f'{code.co_name} ({pathlib.Path(code.co_filename).name}:{lineno})'
+
+def _python_stack(frame) -> List[str]:
+    '''
+    frames of the loop thread below the running callback, root first, empty when the loop is idle
+    '''
+    stack = list()
+    while frame is not None:
+        code = frame.f_code
+        # events.Handle._run runs every callback, above it is the loop itself
+        if code.co_name == '_run' and code.co_filename.endswith('events.py'):
+            return stack[::-1]
+        stack.append(_where(code, frame.f_lineno))
+        frame = frame.f_back
+    return list() # waiting in select
+
+def _await_chain(task: asyncio.Task) -> List[str]:
+    '''
+    where the coroutines of a suspended `task` wait, outermost first
+    '''
+    chain = list()
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None) or getattr(awaitable, 'ag_frame', None)
+        if frame is None: # a future, or a coroutine which just finished
+            if not hasattr(awaitable, 'cr_frame'):
+                chain.append(f'<{type(awaitable).__name__}>')
+            break
+        chain.append(_where(frame.f_code, frame.f_lineno))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None) or getattr(awaitable, 'ag_await', None)
+    return chain
+
+@dataclass
+class _Stall:
+    at: float
+    duration: float
+    stack: str
+
+class Loop_Monitor:
+    '''
+    Event loop lag measured by a heartbeat coroutine every `interval`.
+    A watchdog thread logs the stack of the loop thread when a callback holds it longer than `threshold`,
+    e.g. blocking I/O or CPU work which should go to an executor.
+    '''
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, max_stalls: int = 100):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = deque(maxlen=10000)
+        self.stalls: Deque[_Stall] = deque(maxlen=max_stalls)
+        self._beat = 0.0 # perf_counter of the last heartbeat
+        self._stall: Optional[_Stall] = None
+        self._thread_id: int = None
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._beat = time.perf_counter()
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lags.append(lag)
+            metrics.observe('loop.lag', lag)
+            stall, self._stall = self._stall, None
+            if stall is not None:
+                stall.duration = lag
+                logger.warning(f'Event loop was blocked for {lag * 1000:.0f} ms')
+
+    def __watch(self):
+        # runs in the watchdog thread
+        while not self._stop.wait(self.threshold / 4):
+            overdue = time.perf_counter() - self._beat - self.interval
+            if overdue < self.threshold or self._stall is not None or self._beat == 0:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            self._stall = _Stall(time.time() - overdue, overdue, stack)
+            self.stalls.append(self._stall)
+            logger.warning(f'Event loop blocked for more than {overdue * 1000:.0f} ms in\n{stack}')
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(), name='loop_monitor')
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self.__watch, name='loop_watchdog', daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def stalls_since(self, since: float) -> List[_Stall]:
+        return [s for s in self.stalls if s.at >= since]
+
+    def report(self) -> str:
+        if not self.lags:
+            return 'loop lag: no samples'
+        lags = sorted(self.lags)
+        p = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))] * 1000
+        return (
+            f'loop lag: n={len(lags)} p50 {p(0.5):.1f} ms, p99 {p(0.99):.1f} ms, max {lags[-1] * 1000:.1f} ms, '
+            f'{len(self.stalls)} stalls over {self.threshold * 1000:.0f} ms'
+        )
+
+@dataclass
+class _Session:
+    name: str
+    task: asyncio.Task
+    thread_id: int
+    loop: asyncio.AbstractEventLoop
+    started: float = field(default_factory=time.perf_counter)
+    started_at: float = field(default_factory=time.time)
+    busy: Counter = field(default_factory=Counter) # running stack -> samples
+    waiting: Counter = field(default_factory=Counter) # await chain of the attempt -> samples
+    tasks: Counter = field(default_factory=Counter) # task running while busy -> samples
+    stop: threading.Event = field(default_factory=threading.Event)
+
+class Sampling_Profiler:
+    '''
+    Samples the loop thread every `interval` while a purchase attempt runs.
+    Busy samples are charged to the python stack of the running callback, idle ones
+    (loop waiting in select) to the await chain of the attempt, so network waits show up too.
+    A text report and collapsed stacks (flamegraph.pl / speedscope) are written per attempt.
+    '''
+    def __init__(
+        self,
+        directory: Union[str, pathlib.Path] = './diagnostics',
+        interval: float = 0.002,
+        monitor: Optional[Loop_Monitor] = None,
+        top: int = 15,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.interval = interval
+        self.monitor = monitor
+        self.top = top
+        self.attempts = 0
+
+    def __sample(self, session: _Session):
+        # runs in the sampler thread
+        current_tasks = getattr(asyncio.tasks, '_current_tasks', {})
+        while not session.stop.wait(self.interval):
+            frame = sys._current_frames().get(session.thread_id)
+            if frame is None:
+                continue
+            try:
+                stack = _python_stack(frame)
+                if stack:
+                    session.busy[tuple(stack)] += 1
+                    task = current_tasks.get(session.loop)
+                    session.tasks[task.get_name() if task is not None else '<callback>'] += 1
+                elif not session.task.done():
+                    session.waiting[tuple(_await_chain(session.task))] += 1
+            except (RuntimeError, AttributeError, ValueError): # the coroutine moved on meanwhile
+                continue
+
+    def profile(self, func, name: Optional[str] = None):
+        '''
+        wrap the coroutine function of a purchase attempt, e.g. `flow.get_ticket = profiler.profile(flow.get_ticket)`
+        '''
+        name = name or getattr(func, '__name__', 'attempt')
+
+        @functools.wraps(func)
+        async def profiled(*args, **kwargs):
+            session = _Session(name, asyncio.current_task(), threading.get_ident(), asyncio.get_running_loop())
+            sampler = threading.Thread(target=self.__sample, args=(session,), name='sampling_profiler', daemon=True)
+            sampler.start()
+            result = None
+            try:
+                result = await func(*args, **kwargs)
+                return result
+            except BaseException as e:
+                result = e
+                raise
+            finally:
+                elapsed = time.perf_counter() - session.started
+                session.stop.set()
+                sampler.join(self.interval * 10)
+                self.attempts += 1
+                try:
+                    self.write(session, elapsed, result)
+                except OSError as e:
+                    logger.error(f'Failed to write the profile: {e!r}')
+        return profiled
+
+    def __table(self, title: str, counts: Counter, total: int, elapsed: float, key=lambda k: ' > '.join(k)) -> List[str]:
+        lines = [f'== {title}']
+        for k, n in counts.most_common(self.top):
+            lines.append(f'  {n / total * 100:5.1f}% {n / total * elapsed * 1000:8.1f} ms  {key(k) or "<unknown>"}')
+        return lines
+
+    def report(self, session: _Session, elapsed: float, result) -> str:
+        busy, waiting = sum(session.busy.values()), sum(session.waiting.values())
+        total = max(1, busy + waiting)
+        outcome = repr(result) if isinstance(result, BaseException) else result
+        lines = [
+            f'{session.name}: {elapsed * 1000:.1f} ms, result {outcome}',
+            f'{total} samples every {self.interval * 1000:.1f} ms: busy {busy / total * 100:.1f}%, waiting {waiting / total * 100:.1f}%',
+            '',
+        ]
+        # a wait is charged to the innermost await point of the attempt
+        waits = Counter()
+        for chain, n in session.waiting.items():
+            waits[chain[-3:]] += n
+        lines += self.__table('waiting on (await chain of the attempt)', waits, total, elapsed)
+        lines.append('')
+
+        # self time of the innermost frames, then the callers they ran from
+        leaves, inclusive = Counter(), Counter()
+        for stack, n in session.busy.items():
+            leaves[stack[-1:]] += n
+            for where in set(stack):
+                inclusive[(where,)] += n
+        lines += self.__table('busy, self time', leaves, total, elapsed)
+        lines += self.__table('busy, inclusive', inclusive, total, elapsed)
+        lines += self.__table('busy, by task', Counter({(k,): v for k, v in session.tasks.items()}), total, elapsed)
+
+        if self.monitor is not None:
+            stalls = self.monitor.stalls_since(session.started_at)
+            lines += ['', f'== loop stalls over {self.monitor.threshold * 1000:.0f} ms: {len(stalls)}']
+            for stall in stalls:
+                lines.append(f'  {stall.duration * 1000:.0f} ms in\n{stall.stack}')
+            lines.append(self.monitor.report())
+        return '\n'.join(lines) + '\n'
+
+    def write(self, session: _Session, elapsed: float, result) -> pathlib.Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stem = self.directory / f'{session.name}_{time.strftime("%Y%m%d_%H%M%S", time.localtime(session.started_at))}_{self.attempts}'
+        report = self.report(session, elapsed, result)
+        with open(stem.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+            f.write(report)
+        with open(stem.with_suffix('.folded'), 'w', encoding='utf-8') as f:
+            for stack, n in session.busy.items():
+                f.write(';'.join(('busy',) + stack) + f' {n}\n')
+            for chain, n in session.waiting.items():
+                f.write(';'.join(('waiting',) + chain) + f' {n}\n')
+        logger.info(f'Profile of {session.name} written to {stem}.txt\n{report}')
+        return stem.with_suffix('.txt')
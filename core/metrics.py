@@ -0,0 +1,160 @@
+import bisect
+import functools
+import json
+import logging
+import pathlib
+import time
+from collections import deque
+from typing import Deque, Dict, List, Union
+
+__all__ = [
+    'Metrics',
+    'metrics',
+]
+
+logger = logging.getLogger(__name__)
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max', 'samples')
+
+    def __init__(self, buckets, max_samples: int):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> float:
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+class _Null_Span:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+_NULL_SPAN = _Null_Span()
+
+class Metrics:
+    '''
+    In-memory timing histograms of the purchase phases.
+    Disabled by default, then `span` returns a shared no-op context manager.
+    '''
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    PROMETHEUS_NAME = 'ticket_helper_span_seconds'
+
+    def __init__(self, enabled: bool = False, max_samples: int = 10000):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.histograms: Dict[str, _Histogram] = dict()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def reset(self):
+        self.histograms.clear()
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = _Histogram(self.BUCKETS, self.max_samples)
+        histogram.observe(seconds)
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def timed(self, name: str):
+        '''
+        decorator recording the duration of a coroutine function
+        '''
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: dict(
+            count=h.count,
+            sum=h.sum,
+            mean=h.sum / h.count if h.count else 0.0,
+            p50=h.percentile(50),
+            p90=h.percentile(90),
+            p99=h.percentile(99),
+            max=h.max,
+            buckets={str(le): c for le, c in zip(list(h.buckets) + ['+Inf'], h.counts)},
+        ) for name, h in sorted(self.histograms.items())}
+
+    def prometheus(self) -> str:
+        lines: List[str] = [f'# TYPE {self.PROMETHEUS_NAME} histogram']
+        for name, h in sorted(self.histograms.items()):
+            cumulative = 0
+            for le, count in zip(list(h.buckets) + ['+Inf'], h.counts):
+                cumulative += count
+                lines.append(f'{self.PROMETHEUS_NAME}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.PROMETHEUS_NAME}_sum{{span="{name}"}} {h.sum}')
+            lines.append(f'{self.PROMETHEUS_NAME}_count{{span="{name}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: Union[str, pathlib.Path]):
+        '''
+        write the histograms to `path`, Prometheus text for .prom / .txt, JSON otherwise
+        '''
+        path = pathlib.Path(path)
+        if path.suffix in ('.prom', '.txt'):
+            content = self.prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=4)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        logger.info(f'Metrics written to {path}')
+
+metrics = Metrics()
@@ -0,0 +1,243 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import asyncio
+
+__all__ = [
+    'Captcha_Stats',
+    'OCR_Result',
+    'OCR_Service',
+]
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = ('raw', 'gray', 'binary')
+
+# worker process state, ddddocr is only imported inside the workers
+_ocr = None
+
+def _init_worker():
+    global _ocr
+    import ddddocr
+    import PIL.Image
+    _ocr = ddddocr.DdddOcr()
+    _ocr.classification(PIL.Image.new('RGB', (100, 30), 'white')) # warm up the onnx session
+
+def _preprocess(img, variant: str):
+    import PIL.ImageOps
+    if variant == 'raw':
+        return img
+    gray = PIL.ImageOps.autocontrast(img.convert('L'))
+    if variant == 'gray':
+        return gray
+    if variant == 'binary':
+        return gray.point(lambda p: 255 if p > 128 else 0)
+    raise ValueError(f'Unknown variant {variant}')
+
+def _ctc_decode(result: dict) -> Tuple[str, List[float]]:
+    '''
+    greedy CTC decode of the probability matrix, returns the text and the probability of each character
+    '''
+    import numpy
+    # ddddocr < 1.6 returns charsets / probability, newer versions charset / probabilities
+    charset = result.get('charset', result.get('charsets'))
+    matrix = result.get('probabilities', result.get('probability'))
+    matrix = numpy.asarray(matrix, dtype=numpy.float32).reshape(len(matrix), -1)
+    indexes = matrix.argmax(axis=1)
+    text, probabilities, last = '', list(), 0
+    for step, index in enumerate(indexes):
+        p = float(matrix[step, index])
+        if index != 0 and index == last: # same character over several steps
+            probabilities[-1] = max(probabilities[-1], p)
+        elif index != 0 and charset[index]:
+            text += charset[index]
+            probabilities.append(p)
+        last = index
+    return text, probabilities
+
+def _classify(img_bytes: bytes, variant: str = 'raw') -> Tuple[str, List[float]]:
+    import PIL.Image
+    img = PIL.Image.open(io.BytesIO(img_bytes))
+    text, probabilities = _ctc_decode(_ocr.classification(_preprocess(img, variant), probability=True))
+    return text.upper(), probabilities
+
+def _ping() -> int:
+    return os.getpid()
+
+@dataclass
+class OCR_Result:
+    text: str
+    probabilities: List[float] # per character, of the most confident variant
+    votes: int = 1
+    cached: bool = False
+    digest: str = ''
+
+    @property
+    def confidence(self) -> float:
+        return min(self.probabilities, default=0.0)
+
+    def __repr__(self):
+        return f'[OCR] {self.text} confidence {self.confidence:.2f}, {self.votes} vote(s){", cached" if self.cached else ""}'
+
+@dataclass
+class Captcha_Stats:
+    '''
+    answer accuracy per confidence bucket, used to tune the confidence threshold
+    '''
+    buckets: int = 10
+    results: Dict[int, List[int]] = field(default_factory=lambda: defaultdict(lambda: [0, 0])) # bucket: [correct, total]
+    skipped: int = 0
+    refresh_time: float = 0.0 # sum of seconds from a refresh to the decoded captcha
+    refreshes: int = 0
+    submit_time: float = 0.0 # sum of seconds of the submissions
+    submits: int = 0
+
+    def bucket(self, confidence: float) -> int:
+        return min(int(confidence * self.buckets), self.buckets - 1)
+
+    def record(self, result: OCR_Result, correct: bool, seconds: float = 0.0):
+        counts = self.results[self.bucket(result.confidence)]
+        counts[0] += correct
+        counts[1] += 1
+        self.submit_time += seconds
+        self.submits += 1
+
+    def skip(self):
+        self.skipped += 1
+
+    def refreshed(self, seconds: float):
+        self.refresh_time += seconds
+        self.refreshes += 1
+
+    def expected_time(self, threshold: float) -> Optional[float]:
+        '''
+        expected seconds to a correct answer when submitting only answers above `threshold`,
+        every captcha costs a refresh, every submission a round trip
+        '''
+        total = sum(c[1] for c in self.results.values()) + self.skipped
+        if total == 0 or self.submits == 0:
+            return None
+        refresh = self.refresh_time / self.refreshes if self.refreshes else 0.0
+        submit = self.submit_time / self.submits
+        above = [c for b, c in self.results.items() if b >= self.bucket(threshold)]
+        p_submit = sum(c[1] for c in above) / total
+        p_correct = sum(c[0] for c in above) / total
+        if p_correct == 0:
+            return None
+        return (refresh + p_submit * submit) / p_correct
+
+    def best_threshold(self) -> Optional[float]:
+        '''
+        bucket threshold with the shortest expected time to a correct answer, None without data
+        '''
+        thresholds = {t: self.expected_time(t) for t in [b / self.buckets for b in range(self.buckets)]}
+        thresholds = {t: e for t, e in thresholds.items() if e is not None}
+        return min(thresholds, key=thresholds.get) if thresholds else None
+
+    def report(self) -> str:
+        lines = [f'{b / self.buckets:.1f}-{(b + 1) / self.buckets:.1f}: {c[0]}/{c[1]} correct'
+            for b, c in sorted(self.results.items())]
+        lines.append(f'skipped {self.skipped} low confidence captcha(s)')
+        best = self.best_threshold()
+        if best is not None:
+            lines.append(f'best threshold {best:.1f}, expected {self.expected_time(best):.2f} s per correct answer')
+        return '\n'.join(lines)
+
+class OCR_Service:
+    '''
+    ddddocr models pre-loaded in worker processes, inference never runs on the event loop.
+    Recent answers are kept per image hash, wrong ones are forgotten.
+    '''
+    _default: Optional["OCR_Service"] = None
+
+    def __init__(self, workers: int = 2, variants: Sequence[str] = VARIANTS, length: int = 4, cache_size: int = 64):
+        self.workers = workers
+        self.variants = variants
+        self.length = length
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, OCR_Result]" = OrderedDict()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._warm: Optional[asyncio.Future] = None
+
+    @classmethod
+    def default(cls) -> "OCR_Service":
+        '''
+        process wide service, lets the models warm up before the flow exists
+        '''
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return self._pool
+
+    async def warm_up(self):
+        '''
+        spawn every worker and wait until its model is loaded, later calls share the first warm up
+        '''
+        if self._warm is None:
+            loop = asyncio.get_running_loop()
+            self._warm = asyncio.gather(*[loop.run_in_executor(self.pool, _ping) for _ in range(self.workers)])
+        pids = await asyncio.shield(self._warm)
+        logger.debug(f'OCR workers ready: {sorted(set(pids))}')
+
+    async def classify(self, img_bytes: bytes, variant: str = 'raw') -> Tuple[str, List[float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, _classify, img_bytes, variant)
+
+    async def solve(self, img_bytes: bytes) -> Optional[OCR_Result]:
+        '''
+        classify every variant in parallel, return the most voted answer of the expected length
+        '''
+        digest = hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+        if digest in self.cache:
+            self.cache.move_to_end(digest)
+            result = self.cache[digest]
+            return OCR_Result(result.text, result.probabilities, result.votes, cached=True, digest=digest)
+
+        results = await asyncio.gather(*[self.classify(img_bytes, v) for v in self.variants], return_exceptions=True)
+        answers = [r for r in results if isinstance(r, tuple) and len(r[0]) == self.length]
+        for r in results:
+            if isinstance(r, Exception):
+                logger.error(f'OCR error: {r!r}')
+        if not answers:
+            logger.debug(f'OCR results {results}')
+            return None
+
+        # most votes first, then the most confident, variants are ordered by preference
+        votes: Dict[str, List[List[float]]] = dict()
+        for text, probabilities in answers:
+            votes.setdefault(text, list()).append(probabilities)
+        text = max(votes, key=lambda t: (len(votes[t]), max(min(p) for p in votes[t])))
+        result = OCR_Result(text, max(votes[text], key=min), votes=len(votes[text]), digest=digest)
+        if self.cache_size > 0:
+            self.cache[digest] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def forget(self, result: OCR_Result):
+        '''
+        drop a wrong answer from the cache
+        '''
+        self.cache.pop(result.digest, None)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._warm = None
@@ -0,0 +1,195 @@
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import queue
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+import asyncio
+
+try:
+    import psutil
+except ImportError: # memory / cpu affinity reports are skipped without psutil
+    psutil = None
+
+__all__ = [
+    'Orchestrator',
+    'Worker_Profile',
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Worker_Profile:
+    name: str
+    setting: str # path of the worker's own setting.json
+    user_data_dir: Optional[str] = None # browser profile, a temporary one if None
+    headless: bool = False
+
+    @classmethod
+    def load(cls, path: Union[str, pathlib.Path]) -> List["Worker_Profile"]:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [cls(**p) for p in json.load(f)]
+
+def _memory(browser_pid: Optional[int]) -> Dict[str, float]:
+    if psutil is None:
+        return dict()
+    worker = psutil.Process().memory_info().rss
+    browser = 0
+    if browser_pid is not None:
+        try:
+            process = psutil.Process(browser_pid)
+            browser = sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+        except psutil.Error:
+            pass
+    return dict(worker_mb=worker / 2**20, browser_mb=browser / 2**20)
+
+async def _run_worker(index: int, profile: Worker_Profile, go, go_time, won, reports):
+    import nodriver as uc
+    from .setting import Setting
+    from .ticket_flow import get_ticket_flow_class
+
+    def report(event: str, **kwargs):
+        reports.put(dict(name=profile.name, pid=os.getpid(), event=event, **kwargs))
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    setting = Setting(setting_path=profile.setting)
+    setting.start()
+    flow_class = get_ticket_flow_class(setting.ticket_web, setting.kktix_args.http_only)
+    preload = asyncio.create_task(flow_class.preload())
+    browser = None
+    if not flow_class.BROWSERLESS:
+        browser = await uc.start(user_data_dir=profile.user_data_dir, headless=profile.headless)
+    await preload
+    flow = flow_class(None if browser is None else browser.main_tab, setting)
+    flow.auto_buy = False # purchase only on the orchestrator trigger
+    await flow.start()
+    stopped = (lambda: flow.stop) if browser is None else (lambda: browser.stopped)
+    browser_pid = getattr(browser, '_process_pid', None)
+    report('ready', start_seconds=time.perf_counter() - start, **_memory(browser_pid))
+
+    # wait for the trigger, or for another worker to finish first
+    while not go.wait(0) and not won.is_set():
+        await loop.run_in_executor(None, go.wait, 0.5)
+
+    result = 'stood_down'
+    latency = dict(trigger_latency=time.time() - go_time.value) if go.is_set() else dict()
+    purchase_start = time.perf_counter()
+    while not won.is_set() and not stopped():
+        if not flow.can_buy:
+            await asyncio.sleep(0.1)
+            continue
+        attempt = asyncio.create_task(flow.get_ticket(), name='get_ticket')
+        while not attempt.done() and not won.is_set():
+            await asyncio.wait({attempt}, timeout=0.05)
+        if not attempt.done(): # another worker reached the order page
+            attempt.cancel()
+            break
+        if not attempt.cancelled() and attempt.exception() is None and attempt.result():
+            won.set()
+            result = 'won'
+            break
+        if attempt.exception() is not None:
+            logger.error(f'{profile.name}: {attempt.exception()!r}')
+        await asyncio.sleep(0.25)
+
+    report('done', result=result, purchase_seconds=time.perf_counter() - purchase_start, **latency, **_memory(browser_pid))
+    if result == 'won': # keep the order page open for payment
+        while not stopped():
+            await asyncio.sleep(0.5)
+    await flow.close()
+    if browser is not None:
+        browser.stop()
+
+def _worker(index: int, profile: Worker_Profile, go, go_time, won, reports):
+    from .log import setup_logging
+    setup_logging(console_level=logging.INFO, fmt=f'%(asctime)s - [{profile.name}] %(name)s - %(levelname)s - %(message)s')
+    if psutil is not None:
+        cores = psutil.cpu_count() or 1
+        try:
+            psutil.Process().cpu_affinity([index % cores]) # browser processes inherit it
+        except (AttributeError, psutil.Error): # not supported on macOS
+            pass
+    try:
+        asyncio.run(_run_worker(index, profile, go, go_time, won, reports))
+    except Exception as e:
+        reports.put(dict(name=profile.name, pid=os.getpid(), event='done', result=f'error: {e!r}'))
+
+class Orchestrator:
+    '''
+    One process (browser + Ticket_Flow) per profile, triggered together.
+    The first worker to reach the order page tells the others to stand down.
+    '''
+    def __init__(self, profiles: List[Worker_Profile], hotkey: Optional[str] = 'b'):
+        self.profiles = profiles
+        self.hotkey = hotkey # None triggers as soon as every worker is ready
+        self.context = multiprocessing.get_context('spawn')
+        self.go = self.context.Event()
+        self.go_time = self.context.Value('d', 0.0)
+        self.won = self.context.Event()
+        self.reports = self.context.Queue()
+        self.results: Dict[str, List[dict]] = {p.name: list() for p in profiles}
+
+    def trigger(self):
+        if not self.go.is_set():
+            self.go_time.value = time.time()
+            self.go.set()
+            logger.info('Trigger all workers')
+
+    async def __collect(self, event: str) -> bool:
+        '''
+        wait until every worker sent `event`, False if a worker died first
+        '''
+        loop = asyncio.get_running_loop()
+        while not all(any(r['event'] in (event, 'done') for r in reports) for reports in self.results.values()):
+            try:
+                report = await loop.run_in_executor(None, self.reports.get, True, 0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in self.processes):
+                    return False
+                continue
+            self.results[report['name']].append(report)
+            logger.info(report)
+        return True
+
+    async def run(self) -> Dict[str, List[dict]]:
+        self.processes = [
+            self.context.Process(
+                target=_worker,
+                args=(i, profile, self.go, self.go_time, self.won, self.reports),
+                name=f'worker-{profile.name}',
+            ) for i, profile in enumerate(self.profiles)
+        ]
+        for process in self.processes:
+            process.start()
+
+        if await self.__collect('ready'):
+            if self.hotkey is None:
+                self.trigger()
+            else:
+                from .hotkey import Hotkey_Trigger
+                logger.info(f'All workers ready, press {self.hotkey!r} to start')
+                async def on_press():
+                    self.trigger()
+                await Hotkey_Trigger(self.hotkey, on_press).run(self.go.is_set)
+            await self.__collect('done')
+
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join)
+        self.report()
+        return self.results
+
+    def report(self):
+        for name, reports in self.results.items():
+            ready = next((r for r in reports if r['event'] == 'ready'), {})
+            done = next((r for r in reports if r['event'] == 'done'), {})
+            memory = '' if 'worker_mb' not in done else \
+                f', memory worker {done["worker_mb"]:.0f} MB / browser {done["browser_mb"]:.0f} MB'
+            latency = '' if 'trigger_latency' not in done else \
+                f', trigger latency {done["trigger_latency"] * 1000:.1f} ms, purchase {done["purchase_seconds"]:.2f} s'
+            logger.info(f'[{name}] {done.get("result", "no result")}, start {ready.get("start_seconds", 0):.2f} s{latency}{memory}')
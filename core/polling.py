@@ -0,0 +1,133 @@
+import logging
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Optional
+
+import asyncio
+import aiohttp
+
+from .http_client import Http_Response
+
+__all__ = [
+    'Adaptive_Poller',
+    'Poll_Result',
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Poll_Result:
+    value: Any
+    attempts: int
+    elapsed: float
+    reason: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.value is not None
+
+class Adaptive_Poller:
+    '''
+    Poll until `parse` returns a value: immediate first probe, jittered exponential
+    backoff steered by `Retry-After` / queue position hints, bounded by `budget` seconds.
+    '''
+    RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+    RETRY_AFTER_KEYS = ('retry_after', 'retryAfter', 'wait')
+    POSITION_KEYS = ('position', 'queue_position', 'queuePosition', 'waiting')
+
+    def __init__(
+        self,
+        budget: float = 30,
+        first_delay: float = 0,
+        base_delay: float = 0.1,
+        max_delay: float = 2,
+        factor: float = 1.6,
+        position_delay: float = 0.005, # seconds per person ahead in the queue
+    ):
+        self.budget = budget
+        self.first_delay = first_delay
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.position_delay = position_delay
+
+    @staticmethod
+    def __retry_after(response: Http_Response) -> Optional[float]:
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+
+    def __body_hint(self, body: Any) -> Optional[float]:
+        if not isinstance(body, dict):
+            return None
+        for key in self.RETRY_AFTER_KEYS:
+            if isinstance(body.get(key), (int, float)):
+                return float(body[key])
+        for key in self.POSITION_KEYS:
+            if isinstance(body.get(key), (int, float)):
+                return min(self.max_delay, max(self.base_delay, body[key] * self.position_delay))
+        return None
+
+    async def poll(
+        self,
+        fetch: Callable[[], Awaitable[Http_Response]],
+        parse: Callable[[Any], Any],
+    ) -> Poll_Result:
+        start = time.perf_counter()
+        elapsed = lambda: time.perf_counter() - start
+        delay = self.base_delay
+        attempts = 0
+
+        if self.first_delay > 0:
+            await asyncio.sleep(self.first_delay)
+
+        while True:
+            attempts += 1
+            hint = None
+            # the budget bounds the whole poll, a request timing out on its own is retried
+            request = asyncio.ensure_future(fetch())
+            done, _ = await asyncio.wait({request}, timeout=max(0, self.budget - elapsed()))
+            if not done:
+                request.cancel()
+                return Poll_Result(None, attempts, elapsed(), 'budget exhausted')
+            try:
+                response = request.result()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug(f'Poll #{attempts} error: {e!r}')
+            else:
+                if response.status == 200:
+                    try:
+                        body = response.json()
+                    except ValueError:
+                        body = None
+                    value = parse(body)
+                    if value is not None:
+                        return Poll_Result(value, attempts, elapsed())
+                    hint = self.__body_hint(body)
+                elif response.status in self.RETRY_STATUS:
+                    hint = self.__retry_after(response)
+                else:
+                    logger.error(response.text)
+                    return Poll_Result(None, attempts, elapsed(), f'status {response.status}')
+                logger.debug(f'Poll #{attempts} {response.status} in {response.elapsed * 1000:.1f} ms, hint {hint}')
+
+            if hint is not None:
+                wait = max(0, hint) * random.uniform(1, 1.1)
+            else:
+                wait = random.uniform(delay / 2, delay)
+                delay = min(self.max_delay, delay * self.factor)
+
+            if elapsed() + wait >= self.budget:
+                return Poll_Result(None, attempts, elapsed(), 'budget exhausted')
+            await asyncio.sleep(wait)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import time
+from typing import List, Optional, Union
+
+from nodriver import cdp
+
+__all__ = ['Session_Cache']
+
+logger = logging.getLogger(__name__)
+
+class Session_Cache:
+    '''
+    Login cookies of one site + account on disk, so a valid session skips auto_login.
+    '''
+    def __init__(
+        self,
+        site: str,
+        account: str,
+        ttl: float = 6 * 3600,
+        directory: Union[str, pathlib.Path] = './sessions',
+    ):
+        self.site = site
+        self.ttl = ttl
+        account_hash = hashlib.sha1(account.encode('utf-8')).hexdigest()[:12]
+        self.path = pathlib.Path(directory) / f'{site}_{account_hash}.json'
+
+    def load(self, required: Optional[str] = None) -> List[dict]:
+        '''
+        cached cookies, empty when the session is stale or `required` cookie is missing / expired
+        '''
+        if not self.path.exists():
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Invalid session cache {self.path}: {e!r}')
+            return []
+
+        now = time.time()
+        if now - cache.get('saved_at', 0) > self.ttl:
+            logger.debug(f'Session cache {self.path} expired')
+            return []
+        # session cookies have expires -1
+        cookies = [c for c in cache.get('cookies', []) if c.get('expires', -1) <= 0 or c['expires'] > now]
+        if required is not None and not any(c['name'] == required for c in cookies):
+            logger.debug(f'Session cache {self.path} has no valid {required}')
+            return []
+        return cookies
+
+    def save(self, cookies: List[Union[cdp.network.Cookie, dict]]):
+        '''
+        browser cookies or dicts already in the cache format (Http_Client.export_cookies)
+        '''
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        cache = dict(saved_at=time.time(), cookies=[c if isinstance(c, dict) else dict(
+            name=c.name,
+            value=c.value,
+            domain=c.domain,
+            path=c.path,
+            expires=c.expires,
+            secure=c.secure,
+            httpOnly=c.http_only,
+            sameSite=c.same_site.value if c.same_site is not None else None,
+        ) for c in cookies])
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        logger.debug(f'Session saved to {self.path}')
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+    @staticmethod
+    def to_params(cookies: List[dict]) -> List[cdp.network.CookieParam]:
+        return [cdp.network.CookieParam(
+            name=c['name'],
+            value=c['value'],
+            domain=c.get('domain'),
+            path=c.get('path'),
+            secure=c.get('secure'),
+            http_only=c.get('httpOnly'),
+            same_site=cdp.network.CookieSameSite(c['sameSite']) if c.get('sameSite') else None,
+            expires=cdp.network.TimeSinceEpoch(c['expires']) if c.get('expires', -1) > 0 else None,
+        ) for c in cookies]
@@ -1,9 +1,13 @@
 import logging
 import json
+import os
 import pathlib
-from typing import Optional, Union
+from dataclasses import asdict
+from typing import Callable, List, Optional, Tuple, Union
 
-from .utils import TICKET_WEB, User_Info, KKTIX_Argument
+import asyncio
+
+from .utils import TICKET_WEB, User_Info, KKTIX_Argument, Kham_Argument
 
 __all__ = ['Setting']
 
@@ -29,6 +33,10 @@ class Setting:
         self.auto_login = auto_login
         self.user_info = User_Info.default()
         self.kktix_args = KKTIX_Argument.default()
+        self.kham_args = Kham_Argument.default()
+        self.listeners: List[Callable[["Setting"], None]] = list()
+        self._file_state: Optional[Tuple[int, int]] = None # (mtime_ns, size) last loaded or written
+        self._task: Optional[asyncio.Task] = None
         
         # if setting file exists, load setting from file and return 
         if self.setting_path.exists():
@@ -60,7 +68,44 @@ class Setting:
                 return
             self._ticket_web = TICKET_WEB[value]
 
+    def __file_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.setting_path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def __parse(self, setting: dict) -> Tuple[bool, User_Info, KKTIX_Argument, Kham_Argument]:
+        '''
+        validated values of a setting file, raise ValueError / TypeError when invalid
+        '''
+        auto_login = setting.get('auto_login', False)
+        if not isinstance(auto_login, bool):
+            raise ValueError(f'auto_login must be true or false, got {auto_login!r}')
+        user_info = setting.get('user_info', None)
+        user_info = User_Info(**user_info) if user_info else self.user_info
+        kktix_args = setting.get('kktix_argument', None)
+        kktix_args = KKTIX_Argument(**kktix_args) if kktix_args else self.kktix_args
+        if not isinstance(kktix_args.num_of_ticket, int) or kktix_args.num_of_ticket < 0:
+            raise ValueError(f'num_of_ticket must be a positive integer, got {kktix_args.num_of_ticket!r}')
+        if not isinstance(kktix_args.concurrent_requests, int) or kktix_args.concurrent_requests < 1:
+            raise ValueError(f'concurrent_requests must be at least 1, got {kktix_args.concurrent_requests!r}')
+        if not isinstance(kktix_args.fallback_tickets, list) or not all(isinstance(n, str) for n in kktix_args.fallback_tickets):
+            raise ValueError(f'fallback_tickets must be a list of ticket names, got {kktix_args.fallback_tickets!r}')
+        if not isinstance(kktix_args.queue_poll_budget, (int, float)) or kktix_args.queue_poll_budget <= 0:
+            raise ValueError(f'queue_poll_budget must be above 0 seconds, got {kktix_args.queue_poll_budget!r}')
+        if not isinstance(kktix_args.inventory_poll_interval, (int, float)) or kktix_args.inventory_poll_interval <= 0:
+            raise ValueError(f'inventory_poll_interval must be above 0 seconds, got {kktix_args.inventory_poll_interval!r}')
+        kham_args = setting.get('kham_argument', None)
+        kham_args = Kham_Argument(**kham_args) if kham_args else self.kham_args
+        if not isinstance(kham_args.captcha_threshold, (int, float)) or not 0 <= kham_args.captcha_threshold <= 1:
+            raise ValueError(f'captcha_threshold must be between 0 and 1, got {kham_args.captcha_threshold!r}')
+        if not isinstance(kham_args.captcha_max_skips, int) or kham_args.captcha_max_skips < 0:
+            raise ValueError(f'captcha_max_skips must be a positive integer, got {kham_args.captcha_max_skips!r}')
+        return auto_login, user_info, kktix_args, kham_args
+
     def load_setting(self):
+        self._file_state = self.__file_state()
         if self.setting_path.stat().st_size == 0: # skip empty file
                 logger.warning(f'Empty setting file {self.setting_path}, set default')
                 return
@@ -68,18 +113,66 @@ class Setting:
         with open(self.setting_path, 'r', encoding='utf-8') as f:
             setting = json.load(f)
             self.ticket_web = setting.get('ticket_web', TICKET_WEB.DEFAULT)
-            self.auto_login = setting.get('auto_login', False)
-            user_info = setting.get('user_info', None)
-            if user_info:
-                self.user_info = User_Info(**user_info)
-                
-            kktix_args = setting.get('kktix_argument', None)
-            if kktix_args:
-                self.kktix_args = KKTIX_Argument(**kktix_args)
+            self.auto_login, self.user_info, self.kktix_args, self.kham_args = self.__parse(setting)
+
+    def reload(self) -> bool:
+        '''
+        load the file again, the current values are kept unless the whole file is valid
+        '''
+        self._file_state = self.__file_state()
+        try:
+            with open(self.setting_path, 'r', encoding='utf-8') as f:
+                setting = json.load(f)
+            auto_login, user_info, kktix_args, kham_args = self.__parse(setting)
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f'Invalid setting file {self.setting_path}, keep the current setting: {e!r}')
+            return False
+
+        ticket_web = setting.get('ticket_web', self._ticket_web.name)
+        if str(ticket_web).upper() != self._ticket_web.name:
+            logger.warning(f'ticket_web changed to {ticket_web}, restart to switch site')
+        self.auto_login, self.user_info, self.kktix_args, self.kham_args = auto_login, user_info, kktix_args, kham_args
+        logger.info(f'Setting reloaded from {self.setting_path}')
+        for callback in self.listeners:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f'Setting listener failed: {e!r}')
+        return True
+
+    def add_listener(self, callback: Callable[["Setting"], None]):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[["Setting"], None]):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    async def watch(self, interval: float = 1):
+        while True:
+            await asyncio.sleep(interval)
+            state = self.__file_state()
+            if state is not None and state != self._file_state:
+                self.reload()
+
+    def start(self, interval: float = 1):
+        '''
+        reload the setting whenever the file changes
+        '''
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.watch(interval), name='setting_watch')
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
     def save_setting(self):
-        with open(self.setting_path, 'w', encoding='utf-8') as f:
+        # write then rename, the watcher never reads half a file nor reloads its own write
+        tmp = self.setting_path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
             f.write(self.__repr__())
+        os.replace(tmp, self.setting_path)
+        self._file_state = self.__file_state()
 
     def __repr__(self):
         '''
@@ -89,5 +182,6 @@ class Setting:
             'ticket_web': self._ticket_web.name.upper(),
             'auto_login': self.auto_login,
             'user_info': self.user_info.__dict__,
-            'kktix_argument': self.kktix_args.__dict__,
+            'kktix_argument': asdict(self.kktix_args),
+            'kham_argument': asdict(self.kham_args),
         }, indent=4, ensure_ascii=False)
\ No newline at end of file
@@ -0,0 +1,82 @@
+import logging
+from typing import List, Optional
+
+import asyncio
+from nodriver import Browser, Tab
+
+__all__ = ['Tab_Pool']
+
+logger = logging.getLogger(__name__)
+
+class Tab_Pool:
+    '''
+    Pre-opened tabs of the logged in browser, parked on `warm_url` so the connection,
+    TLS session and static assets of the site are ready when a final URL is handed off.
+    '''
+    def __init__(self, browser: Browser, size: int = 1, warm_url: str = 'about:blank', keep_alive: float = 60):
+        self.browser = browser
+        self.size = size
+        self.warm_url = warm_url
+        self.keep_alive = keep_alive
+        self.tabs: List[Tab] = list()
+        self._fill: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def __open(self) -> Tab:
+        return await self.browser.get(self.warm_url, new_tab=True)
+
+    async def fill(self):
+        while len(self.tabs) < self.size:
+            tab = await self.__open()
+            self.tabs.append(tab)
+            logger.debug(f'Warm tab ready on {self.warm_url}')
+
+    def __refill(self):
+        if self._fill is None or self._fill.done():
+            self._fill = asyncio.create_task(self.fill(), name='tab_pool_fill')
+
+    async def acquire(self) -> Tab:
+        '''
+        a warm tab, a cold one when the pool is empty, the pool refills in the background
+        '''
+        tab = self.tabs.pop(0) if self.tabs else None
+        if tab is None:
+            logger.warning('No warm tab left, opening a cold one')
+            tab = await self.__open()
+        self.__refill()
+        return tab
+
+    async def open(self, url: str) -> Tab:
+        '''
+        hand `url` off to a warm tab and bring it to the front
+        '''
+        tab = await self.acquire()
+        await tab.get(url)
+        await tab.bring_to_front()
+        return tab
+
+    async def run(self):
+        # an idle connection is dropped after a few minutes, touch the site now and then
+        while True:
+            await asyncio.sleep(self.keep_alive)
+            for tab in list(self.tabs):
+                try:
+                    await tab.evaluate(f'fetch({self.warm_url!r}, {{method: "HEAD", cache: "no-store"}}).catch(() => null)')
+                except Exception as e:
+                    logger.debug(f'Warm tab keep alive failed: {e!r}')
+
+    def start(self):
+        self.__refill()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(), name='tab_pool')
+
+    async def close(self):
+        for task in (self._fill, self._task):
+            if task is not None:
+                task.cancel()
+        for tab in self.tabs:
+            try:
+                await tab.close()
+            except Exception:
+                pass
+        self.tabs.clear()
@@ -0,0 +1,315 @@
+import base64
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import asyncio
+import logging
+from nodriver import Tab, cdp
+
+from .metrics import metrics
+from .ocr import Captcha_Stats, OCR_Result, OCR_Service
+from .setting import Setting
+from .ticket_flow import Ticket_Flow
+
+__all__ = ['Ticket_Flow_Kham']
+
+logger = logging.getLogger(__name__)
+
+class Ticket_Flow_Kham(Ticket_Flow):
+    HOME_URL='https://www.kham.com.tw/'
+    LOGIN_URL='https://kham.com.tw/application/utk13/utk1306_.aspx'
+    SESSION_COOKIE='ASP.NET_SessionId' # also issued to anonymous visitors, is_logged_in asks the site
+    LOGGED_IN_MARKER='登出' # logout link of the page header, only there once logged in
+    SESSION_TTL=20 * 60 # server side session timeout
+    LOGIN_TIMEOUT=10
+    CART_TIMEOUT=10
+    LOGIN_CAPTCHA_TRIES=3
+    TUNE_AFTER=10 # checked answers before the captcha threshold follows the stats
+
+    login_js = '''
+        o = {{
+            "ACCOUNT": "{account}",
+            "PASSWORD": "㎞" + window.btoa("{password}"),
+            "CHK": "{chk}",
+        }};
+        DoPost("action=DO_LOGIN&post=" + encodeURIComponent(JSON.stringify(o)), "/Application/UTK13/UTK1306_.aspx", function(i, n) {{
+            hideProcess()
+        }})
+    '''
+
+    refresh_captcha_js = '''
+        (() => {
+            const img = document.querySelector('img[src*="pic.aspx"]');
+            if (!img) return false;
+            const url = new URL(img.src, location.href);
+            url.searchParams.set('_', Date.now());
+            img.src = url.href;
+            return true;
+        })()
+    '''
+
+    def __init__(
+        self,
+        page: Tab,
+        setting: Setting,
+    ):
+        super().__init__(page, setting)
+        self.ocr = OCR_Service.default()
+        self.captcha_res_id = None # request id of the newest captcha image
+        self.captcha_task: Optional[asyncio.Task] = None # decoding of the newest captcha image
+        self.captcha_ready = asyncio.Event()
+        self.captcha_stats = Captcha_Stats()
+        self.refresh_at: Optional[float] = None
+        self.captcha_skips = 0 # unsure captchas refreshed in a row
+        self.page.add_handler(cdp.network.ResponseReceived, self.__get_response)
+        self.page.add_handler(cdp.network.LoadingFinished, self.__loading_finished)
+        self.page.add_handler(cdp.page.JavascriptDialogOpening, self.__dialog_opening)
+
+    async def __get_response(self, event: cdp.network.ResponseReceived):
+        url = event.response.url
+        if 'pic.aspx' in url:
+            logger.debug(f'captcha url: {url}')
+            # a newer captcha makes the previous one stale
+            if self.captcha_task is not None:
+                self.captcha_task.cancel()
+            self.captcha_task = None
+            self.captcha_ready.clear()
+            self.captcha_res_id = event.request_id
+
+    async def __loading_finished(self, event: cdp.network.LoadingFinished):
+        # body is available now, decode it before anyone asks for it
+        if event.request_id == self.captcha_res_id:
+            self.captcha_task = asyncio.create_task(self.__decode_captcha(event.request_id), name='decode_captcha')
+            self.captcha_ready.set()
+
+    async def __dialog_opening(self, event: cdp.page.JavascriptDialogOpening):
+        # alerts block the page scripts, e.g. the wrong captcha message
+        logger.warning(f'Dialog: {event.message}')
+        await self.page.send(cdp.page.handle_java_script_dialog(accept=True))
+
+    def _on_site(self, url: str) -> bool:
+        return urlsplit(url).hostname in (urlsplit(self.HOME_URL).hostname, urlsplit(self.LOGIN_URL).hostname)
+
+    def _is_login_page(self, url: str) -> bool:
+        return urlsplit(url).path.lower() == urlsplit(self.LOGIN_URL).path.lower()
+
+    def __is_outcome(self, event) -> bool:
+        if isinstance(event, cdp.page.FrameNavigated):
+            return event.frame.parent_id is None
+        if isinstance(event, cdp.network.ResponseReceived):
+            # trackers & beacons of other hosts fail on their own
+            return event.type_ in (cdp.network.ResourceType.XHR, cdp.network.ResourceType.FETCH) and \
+                event.response.status >= 400 and self._on_site(event.response.url)
+        return True
+
+    async def __submit(self, js: str, timeout: float) -> bool:
+        '''
+        evaluate `js` and wait for its outcome, True once the main frame navigates away from the login page,
+        False on a dialog, a failed xhr of the site or timeout
+        '''
+        outcome = self.expect(
+            cdp.page.FrameNavigated, cdp.page.JavascriptDialogOpening, cdp.network.ResponseReceived,
+            predicate=self.__is_outcome,
+        )
+        action = asyncio.create_task(self.page.evaluate(js))
+        try:
+            event = await asyncio.wait_for(outcome, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'No response in {timeout} s')
+            return False
+        finally:
+            if not action.done():
+                action.cancel() # navigation may leave the evaluate without a reply
+        if isinstance(event, cdp.network.ResponseReceived):
+            logger.error(f'{event.response.url} {event.response.status}')
+            return False
+        if isinstance(event, cdp.page.FrameNavigated) and self._is_login_page(event.frame.url):
+            logger.error(f'Redirected to the login page: {event.frame.url}')
+            return False
+        return isinstance(event, cdp.page.FrameNavigated)
+
+    async def __captcha_box(self):
+        '''
+        captcha input of the performance page, checked again on every page load
+        '''
+        while True:
+            loaded = self.expect(cdp.page.DomContentEventFired)
+            captcha_box = await self.page.query_selector('input#CHK')
+            if captcha_box:
+                loaded.cancel()
+                return captcha_box
+            try:
+                await asyncio.wait_for(loaded, 1) # also catches inputs added by scripts
+            except asyncio.TimeoutError:
+                pass
+
+    @metrics.timed('kham.decode_captcha')
+    async def __decode_captcha(self, request_id: cdp.network.RequestId) -> Optional[OCR_Result]:
+        body, is_base64 = await self.page.send(cdp.network.get_response_body(request_id))
+        if not is_base64:
+            logger.error('response body is not base64, can\'t decode')
+            return None
+
+        img_bytes = base64.b64decode(body)
+        res = await self.ocr.solve(img_bytes)
+        if res is None:
+            logger.error('OCR failed')
+        else:
+            logger.debug(res)
+        return res
+
+    async def __refresh_captcha(self):
+        # request the next captcha right away, it is decoded by the time we retry
+        self.refresh_at = time.perf_counter()
+        await self.page.evaluate(self.refresh_captcha_js)
+
+    @property
+    def captcha_threshold(self) -> float:
+        '''
+        kham_argument.captcha_threshold, the best one of the captcha stats once enough answers were checked
+        '''
+        kham_args = self.setting.kham_args
+        if kham_args.auto_threshold and self.captcha_stats.submits >= self.TUNE_AFTER:
+            best = self.captcha_stats.best_threshold()
+            if best is not None:
+                return best
+        return kham_args.captcha_threshold
+
+    async def __next_captcha(self) -> Optional[OCR_Result]:
+        '''
+        answer of the current captcha, an unsure answer refreshes the captcha instead of being submitted
+        unless `captcha_max_skips` were refreshed in a row already
+        '''
+        res = await self.__solve_captcha()
+        if self.refresh_at is not None:
+            self.captcha_stats.refreshed(time.perf_counter() - self.refresh_at)
+            self.refresh_at = None
+        if res is not None and res.confidence < self.captcha_threshold:
+            if self.captcha_skips < self.setting.kham_args.captcha_max_skips:
+                logger.debug(f'Skip low confidence {res}')
+                self.captcha_stats.skip()
+                self.captcha_skips += 1
+                res = None
+            else:
+                logger.debug(f'Submit low confidence {res} after {self.captcha_skips} skips')
+        if res is not None:
+            self.captcha_skips = 0
+        if res is None:
+            await self.__refresh_captcha()
+        return res
+
+    @metrics.timed('kham.solve_captcha')
+    async def __solve_captcha(self, timeout: float = 5) -> Optional[OCR_Result]:
+        while True:
+            try:
+                await asyncio.wait_for(self.captcha_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.error('doesn\'t receive captcha source')
+                return None
+
+            task = self.captcha_task
+            if task is None: # a newer captcha arrived since, wait for its body
+                self.captcha_ready.clear()
+                continue
+            await asyncio.wait({task})
+            if task is not self.captcha_task: # replaced by a newer captcha while decoding
+                continue
+
+            # each captcha is answered once
+            self.captcha_task = None
+            self.captcha_ready.clear()
+            if task.cancelled() or task.exception() is not None:
+                logger.error(f'Captcha decode failed: {None if task.cancelled() else task.exception()!r}')
+                return None
+            return task.result()
+
+    @classmethod
+    async def preload(cls):
+        await OCR_Service.default().warm_up()
+
+    @metrics.timed('kham.start')
+    async def start(self):
+        await self.page.send(cdp.page.enable()) # navigation & dialog events
+        with metrics.span('kham.ocr_warm_up'):
+            await self.ocr.warm_up()
+        await super().start()
+
+    async def close(self):
+        if self.captcha_stats.submits:
+            logger.info(f'Captcha accuracy:\n{self.captcha_stats.report()}')
+        self.ocr.close()
+        await super().close()
+
+    async def is_logged_in(self) -> bool:
+        # fetch from a kham page so the request carries the session, same origin avoids CORS
+        if not self._on_site(self.page.target.url):
+            await self.page.get(self.HOME_URL)
+        try:
+            html = await self.page.evaluate(
+                'fetch(location.origin + "/", {credentials: "include", cache: "no-store"}).then(r => r.text())',
+                await_promise=True,
+            )
+        except Exception as e:
+            logger.debug(f'Login probe failed: {e!r}')
+            return False
+        return isinstance(html, str) and self.LOGGED_IN_MARKER in html
+
+    @metrics.timed('kham.auto_login')
+    async def auto_login(self):
+        with metrics.span('kham.login_page'):
+            await self.page.get(self.LOGIN_URL)
+            await self.page.get_content()
+
+        for _ in range(self.LOGIN_CAPTCHA_TRIES + self.setting.kham_args.captcha_max_skips):
+            if (res := await self.__next_captcha()) is not None:
+                break
+        else:
+            logger.error('Captcha solve failed, please login manually.')
+            return
+        
+        # run login method
+        user_info = self.setting.user_info
+        js_cmd = self.login_js.format(account=user_info.account, password=user_info.password, chk=res.text)
+        logger.debug('login...')
+        
+        start = time.perf_counter()
+        with metrics.span('kham.login_post'):
+            logged_in = await self.__submit(js_cmd, self.LOGIN_TIMEOUT)
+        self.captcha_stats.record(res, logged_in, time.perf_counter() - start)
+        if logged_in:
+            logger.debug('login done')
+            await self.save_session()
+        else:
+            logger.error('login failed, please login manually.')
+
+    @metrics.timed('kham.get_ticket')
+    async def get_ticket(self)->bool:
+        logger.info('Start get ticket!!')
+
+        captcha_box = await self.__captcha_box()
+        
+        got_ticket = False
+        while got_ticket is False:
+
+            res = await self.__next_captcha()
+            if res is None:
+                continue
+            start = time.perf_counter()
+            with metrics.span('kham.add_cart'):
+                await captcha_box.clear_input()
+                await captcha_box.send_keys(res.text)
+                got_ticket = await self.__submit('addShoppingCart()', self.CART_TIMEOUT)
+            # a rejection is counted as a wrong answer, even when the cart failed for another reason
+            self.captcha_stats.record(res, got_ticket, time.perf_counter() - start)
+
+            if not got_ticket:
+                self.ocr.forget(res)
+                logger.debug(f'Captcha accuracy:\n{self.captcha_stats.report()}')
+                await self.__refresh_captcha()
+        logger.info('Got Ticket!!!')
+        return True
+
+    @property
+    def can_buy(self):
+        return 'PERFORMANCE_ID' in self.page.target.url
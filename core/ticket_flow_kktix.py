@@ -0,0 +1,668 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import re
+import time
+from datetime import datetime, timezone
+import json
+
+import asyncio
+import logging
+from nodriver import cdp
+
+from .captcha_answers import Captcha_Answer_Store
+from .clock import Sale_Scheduler, Server_Clock
+from .event_cache import Event_Cache
+from .http_client import Http_Client
+from .inventory import INVENTORY_EVENT, Inventory_Event, Inventory_Monitor
+from .metrics import metrics
+from .polling import Adaptive_Poller
+from .setting import Setting
+from .ticket_selector import Ticket_Selector
+from .ticket_flow import Ticket_Flow
+
+__all__ = ['Ticket_Flow_KKTix']
+
+logger = logging.getLogger(__name__)
+
+class Ticket_Flow_KKTix(Ticket_Flow):
+    HOME_URL = "https://kktix.com/"
+    LOGIN_URL = "https://kktix.com/users/sign_in"
+    SESSION_COOKIE = "user_id_v2"
+    EVENT_CACHE_TTL = 30 * 60
+    PAGE_LOAD_TIMEOUT = 10 # the inventory is set by a script of the event page
+    AUTO_BUY_RETRY = 5 # seconds before a failed auto buy with tickets left retries without a stock event
+    WARM_TABS = 1
+
+    QUEUE_URL = "https://queue.kktix.com/"
+
+    rigister_info_api = "https://kktix.com/g/events/{event_id}/register_info"
+    base_info_api = "https://kktix.com/g/events/{event_id}/base_info"
+    order_page = "https://kktix.com/events/{event_id}/registrations/{page_id}"
+    order_page_id = "https://queue.kktix.com/queue/token/{token}"
+    queue_api = "https://queue.kktix.com/queue/{event_id}?authenticity_token={token}"
+
+    event_pattern = r'events/(.+)/registrations'
+    queue_headers = {'Content-Type': 'application/json'}
+
+    @dataclass
+    class Ticket:
+        id: int
+        ticketInventory: int
+        price: int
+        currency: str
+        name: str
+        sys_time: datetime
+        start_at: datetime
+        end_at_for_registration: datetime
+        hasPending: bool = False
+
+        @property
+        def isStarted(self) -> bool:
+            return self.sys_time > self.start_at
+
+        @property
+        def isEnded(self) -> bool:
+            return self.sys_time > self.end_at_for_registration
+        
+        @property
+        def isSoldOut(self) -> bool:
+            return self.isStarted and not self.isEnded and self.ticketInventory == 0 and not self.hasPending
+        
+        @property
+        def isOutOfStock(self) -> bool:
+            return not self.isStarted or self.isEnded or self.isSoldOut
+
+        @classmethod
+        def from_json(cls, inventory: dict, base_info: dict, sys_time: Optional[datetime] = None) -> "Ticket_Flow_KKTix.Ticket":
+            _id = str(base_info['id'])
+            return cls(
+                sys_time = sys_time or datetime.now(timezone.utc),
+                id = base_info['id'],
+                name = base_info['name'],
+                price = base_info['price']['cents'] / 100,
+                currency = base_info['price']['currency'],
+                start_at = datetime.fromisoformat(base_info['start_at']),
+                end_at_for_registration = datetime.fromisoformat(base_info['end_at_for_registration']),
+                ticketInventory = inventory['ticketInventory'][_id],
+                hasPending=inventory['hasPending'][_id],
+            )
+        
+        def __repr__(self):
+            return f"[Ticket] {self.name} ${self.price} {self.currency}, valid {self.ticketInventory}, {self.start_at}-{self.end_at_for_registration}"
+
+    @dataclass
+    class ShowStatus:
+        tickets: List["Ticket_Flow_KKTix.Ticket"]
+        event_id: str
+        captcha_type: int
+        captcha_question: str = ""
+        recaptcha_sitekey: str = ""
+        registerStatus: str = "OUTSOLD_OUT"
+
+        @classmethod
+        def from_json(cls, event_id: str, inventory: dict, base_info: dict, 
+                    sitekey:str="", question:str="", sys_time:Optional[datetime]=None, **args) -> "Ticket_Flow_KKTix.ShowStatus":
+            return cls(
+                event_id=event_id,
+                captcha_type=base_info['event']['captcha_type'],
+                recaptcha_sitekey=sitekey,
+                captcha_question=question,
+                registerStatus=inventory['registerStatus'],
+                tickets=[Ticket_Flow_KKTix.Ticket.from_json(inventory, t, sys_time) for t in base_info['tickets']],
+            )
+
+        def __repr__(self):
+            captcha_str = f"KTX Captcha: \"{self.captcha_question}\""
+            recaptcha_str = f"ReCaptcha: \"{self.recaptcha_sitekey}\""
+            ticket_str = "\n".join([str(t) for t in self.tickets])
+
+            return f'[ShowStatus] id\"{self.event_id}\" {self.registerStatus}, {len(self.tickets)} type of ticket\n'+\
+                f'{"No Captcha" if self.captcha_type==0 else captcha_str if self.captcha_type==2 else recaptcha_str}\n'+\
+                f'{ticket_str}\n'
+
+    @dataclass
+    class Armed:
+        '''
+        queue requests ready to send: serialized bodies for the current ShowStatus and session
+        '''
+        target: "Ticket_Flow_KKTix.Ticket"
+        api: str
+        requests: List[Tuple[str, bytes]] # (label, body)
+
+    def __init__(self, page, setting):
+        super().__init__(page, setting)
+        if self.page is not None: # None in the browserless flow
+            self.page.add_handler(cdp.network.ResponseReceived, self.__get_response)
+            self.page.add_handler(cdp.network.ResponseReceivedExtraInfo, self.__get_response_extra)
+        self.current_event = None
+        self.kktix_args = setting.kktix_args
+        self.redirct_to_event_page = self.kktix_args.valid_page_url
+        self.tasks = set()
+        self.showStatus = None
+        self.armed: Optional[Ticket_Flow_KKTix.Armed] = None
+        self.xsrf_token: Optional[str] = None
+        self.monitor: Optional[Inventory_Monitor] = None
+        self.page_loaded: Optional[asyncio.Future] = None
+        self.selector = Ticket_Selector(self.kktix_args.rules, self.kktix_args.num_of_ticket)
+        self.event_cache = Event_Cache('kktix', self.EVENT_CACHE_TTL)
+        self.captcha_store = Captcha_Answer_Store()
+        self.captcha_answer: Optional[str] = None
+        self.stock_changed = asyncio.Event()
+        self.http = Http_Client(
+            hosts=[self.HOME_URL, self.QUEUE_URL],
+            limit_per_host=max(4, self.kktix_args.concurrent_requests),
+        )
+        self.clock = Server_Clock(self.http, self.HOME_URL)
+        self.poller = Adaptive_Poller(budget=self.kktix_args.queue_poll_budget)
+        self.scheduler = Sale_Scheduler(self.clock, prepare=lambda: self.http.warm_up(self.kktix_args.concurrent_requests))
+
+    async def __evaluate(self, expression: str, retries: int = 3, delay: float = 0.5):
+        '''
+        evaluate on the page, retried a few times while the page scripts are still loading
+        '''
+        for attempt in range(1, retries + 1):
+            try:
+                result = await self.page.evaluate(expression)
+                if not isinstance(result, cdp.runtime.ExceptionDetails):
+                    return result
+                error = Exception(result.exception.description if result.exception else result.text)
+            except Exception as e:
+                error = e
+            logger.warning(f'Evaluate {expression} failed ({attempt}/{retries}): {error!r}')
+            if attempt < retries:
+                await asyncio.sleep(delay)
+        raise error
+
+    async def __fetch_event_info(self, event_id: str) -> dict:
+        '''
+        static part of the show: base_info, captcha question and recaptcha sitekeys
+        '''
+        async def base_info():
+            response = await self.http.get(self.base_info_api.format(event_id=event_id))
+            return response.json()['eventData']
+
+        async def question():
+            # the question only exists on custom captcha events, asked before base_info tells the type,
+            # so a failure here must not break the show info of other events
+            try:
+                response = await self.http.get(self.rigister_info_api.format(event_id=event_id))
+                body = response.json()
+                return ((body.get('ktx_captcha') if isinstance(body, dict) else None) or dict()).get('question', '')
+            except Exception as e:
+                logger.warning(f'No captcha question of {event_id}: {e!r}')
+                return ''
+
+        async def recaptcha():
+            if self.page is None:
+                return dict()
+            try:
+                await self.__page_ready()
+                return await self.__evaluate('TIXGLOBAL.pageInfo.recaptcha', retries=1)
+            except Exception:
+                return dict()
+
+        base_info, question, recaptcha = await asyncio.gather(base_info(), question(), recaptcha())
+        return dict(base_info=base_info, question=question, recaptcha=recaptcha or dict())
+
+    def __expect_page_load(self):
+        '''
+        expect DOMContentLoaded of the event page, call it before the document arrives
+        '''
+        if self.page is not None and (self.page_loaded is None or self.page_loaded.done()):
+            self.page_loaded = self.expect(cdp.page.DomContentEventFired)
+
+    async def __page_ready(self):
+        # the show info starts on the document response, before the page scripts ran
+        if self.page_loaded is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self.page_loaded), self.PAGE_LOAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f'Event page not loaded after {self.PAGE_LOAD_TIMEOUT} s')
+
+    async def _fetch_inventory(self, event_id: str) -> dict:
+        await self.__page_ready()
+        return await self.__evaluate('inventory.inventory')
+
+    @metrics.timed('kktix.get_show_info')
+    async def __get_show_info(self, event_url):
+        _res = re.search(self.event_pattern, event_url)
+        if _res is None:
+            logger.error("Get event id failed!!")
+            return
+        event_id = _res.group(1)
+        logger.debug(f'Getting show {event_id} info!! {event_url}')
+
+        # only the inventory is volatile, the rest comes from the cache when possible
+        info = self.event_cache.load(event_id)
+        cached = info is not None
+        try:
+            if not cached:
+                inventory, info = await asyncio.gather(self._fetch_inventory(event_id), self.__fetch_event_info(event_id))
+                if info['question'] or info['base_info']['event']['captcha_type'] != 2: # fetch a missing question again
+                    self.event_cache.save(event_id, info)
+            else:
+                inventory = await self._fetch_inventory(event_id)
+        except Exception as e:
+            logger.error(f'Failed to get show {event_id} info, reload the event page to retry: {e!r}')
+            return
+
+        base_info = info['base_info']
+        added = set(inventory.get('ticketInventory', {})) - {str(t['id']) for t in base_info['tickets']}
+        if cached and added:
+            # ticket types added since they were cached
+            logger.warning(f'Event cache of {event_id} is outdated, new tickets {sorted(added)}')
+            self.event_cache.clear(event_id)
+            await self.__get_show_info(event_url)
+            return
+        status = dict(event_id=event_id, inventory=inventory, base_info=base_info, sys_time=self.clock.now())
+        captcha_type = base_info['event']['captcha_type']
+        # reCaptcha v2 & enterprise
+        if captcha_type in [1, 3]:
+            status['sitekey'] = info['recaptcha'].get('sitekeyNormal' if captcha_type==1 else 'sitekeyAdvanced', '')
+        # KKTix captcha
+        elif captcha_type == 2:
+            status['question'] = info['question']
+
+        # set status to showStatus object
+        try:
+            self.showStatus = self.ShowStatus.from_json(**status)
+        except KeyError as e:
+            if not cached:
+                raise
+            # ticket definitions changed since they were cached
+            logger.warning(f'Event cache of {event_id} is outdated: {e!r}')
+            self.event_cache.clear(event_id)
+            await self.__get_show_info(event_url)
+            return
+        if logger.isEnabledFor(logging.DEBUG): # the monitor updates the tickets in place, log them as of now
+            logger.debug(repr(self.showStatus))
+        self.__watch_inventory(self.showStatus)
+        self.__prepare_captcha(self.showStatus)
+        await self.__arm_session()
+
+    def __setting_answer(self, status: "Ticket_Flow_KKTix.ShowStatus") -> Optional[str]:
+        '''
+        kktix_argument.captcha_answer, it replaces the stored answer so a wrong one can be fixed in setting.json
+        '''
+        answer = self.kktix_args.captcha_answer
+        if not answer:
+            return None
+        if self.captcha_store.get(status.event_id, status.captcha_question) != answer:
+            self.captcha_store.set(status.event_id, status.captcha_question, answer, source='setting')
+        return answer
+
+    def __prepare_captcha(self, status: "Ticket_Flow_KKTix.ShowStatus"):
+        '''
+        answer the custom captcha before the sale, the armed payload carries it
+        '''
+        self.captcha_answer = None
+        if status.captcha_type != 2 or not status.captcha_question:
+            return
+        self.captcha_answer = self.__setting_answer(status) or self.captcha_store.get(status.event_id, status.captcha_question)
+        if self.captcha_answer is not None or any(t.get_name() == 'prepare_captcha' for t in self.tasks):
+            return
+
+        async def prepare():
+            answer = await self.captcha_store.prepare(status.event_id, status.captcha_question)
+            current = self.showStatus # the page may have been reloaded meanwhile
+            if answer is not None and current is not None and not self.kktix_args.captcha_answer and \
+                    (current.event_id, current.captcha_question) == (status.event_id, status.captcha_question):
+                self.captcha_answer = answer
+                self.__arm_payload()
+        task = asyncio.create_task(prepare(), name='prepare_captcha')
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def __watch_inventory(self, status: "Ticket_Flow_KKTix.ShowStatus"):
+        url = self.rigister_info_api.format(event_id=status.event_id)
+        if self.monitor is not None and self.monitor.url == url:
+            self.monitor.status = status # same event, reloaded page
+            return
+        if self.monitor is not None:
+            self.monitor.stop()
+        self.monitor = Inventory_Monitor(self.http, url, status, self.kktix_args.inventory_poll_interval, clock=self.clock.now)
+        self.monitor.add_listener(self.__on_inventory)
+        self.monitor.start()
+
+    def __on_inventory(self, event: Inventory_Event):
+        self.__arm_payload()
+        if event.kind in (INVENTORY_EVENT.IN_STOCK, INVENTORY_EVENT.PENDING_CLEARED) or \
+                (event.kind == INVENTORY_EVENT.STATUS_CHANGED and event.new == 'IN_STOCK'):
+            logger.info(event)
+            self.stock_changed.set()
+
+    async def __get_response(self, event: cdp.network.ResponseReceived):
+        url = event.response.url
+        if self.HOME_URL == url:
+            self.showStatus = None
+            self.armed = None
+            if self.monitor is not None:
+                self.monitor.stop()
+                self.monitor = None
+
+        elif self.HOME_URL in url: # ticket page
+            if 'events' in url and url.endswith('registrations/new'):
+                self.__expect_page_load()
+                if any(filter(lambda t: t.get_name() == 'get_show_info', self.tasks)):
+                    logger.warning('Cancel previous task')
+                    for t in filter(lambda t: t.get_name() == 'get_show_info', self.tasks):
+                        t.cancel()
+                task = asyncio.create_task(self.__get_show_info(url), name='get_show_info')
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def __get_response_extra(self, event: cdp.network.ResponseReceivedExtraInfo):
+        # keep the armed session in sync with cookies set by the site
+        if self.showStatus is None or not any(k.lower() == 'set-cookie' for k in event.headers):
+            return
+        if any(t.get_name() == 'arm_session' for t in self.tasks):
+            return
+        task = asyncio.create_task(self.__arm_session(), name='arm_session')
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def on_setting_changed(self, setting: Setting):
+        old_args, self.kktix_args = self.kktix_args, setting.kktix_args
+        self.redirct_to_event_page = self.kktix_args.valid_page_url
+        self.poller.budget = self.kktix_args.queue_poll_budget
+        self.selector = Ticket_Selector(self.kktix_args.rules, self.kktix_args.num_of_ticket)
+        if self.monitor is not None:
+            self.monitor.interval = self.kktix_args.inventory_poll_interval
+        status = self.showStatus
+        if status is not None and status.captcha_type == 2 and status.captcha_question and self.kktix_args.captcha_answer:
+            self.captcha_answer = self.__setting_answer(status)
+        if self.kktix_args.concurrent_requests > self.http.limit_per_host:
+            logger.warning(f'concurrent_requests above {self.http.limit_per_host} wait for a free connection until restart')
+        # new targets for the current show
+        self.__arm_payload()
+        logger.info(f'Re-armed: {self.armed.requests[0][0] if self.armed else "no ticket available"}')
+
+        if self.redirct_to_event_page and old_args.event_page != self.kktix_args.event_page:
+            task = asyncio.create_task(self.__open_event(), name='open_event')
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def __open_event(self):
+        await self._open_event_page()
+        await self.__get_show_info(self.kktix_args.event_page)
+
+    @metrics.timed('kktix.auto_login')
+    async def auto_login(self):
+        await self.page.get(self.LOGIN_URL)
+        await self.page.wait_for("form#new_user")
+        login_js = f"""
+            const userForm = document.querySelector("form#new_user");
+            const formData = new FormData(userForm);
+            formData.append('user[login]', '{self.setting.user_info.account}');
+            formData.append('user[password]', '{self.setting.user_info.password}');
+            fetch(form.action,{{
+                method: "POST",
+                body: formData
+            }}).then(response => response.url)
+            .then(url => window.location = url )
+            .catch(error => {{
+                console.error("Error:", error);
+                userForm.submit();
+            }});
+        """
+        await self.page.evaluate(login_js)
+        if not await self.save_session(timeout=15):
+            logger.error('login failed, please login manually.')
+
+    def __queue_candidates(self) -> List[Tuple["Ticket_Flow_KKTix.Ticket", int]]:
+        '''
+        (ticket, quantity) pairs for the queue requests, the first one is the best available target
+        '''
+        if self.selector.tickets is not self.showStatus.tickets:
+            self.selector.index(self.showStatus.tickets)
+        available = self.selector.update(self.clock.now())
+        if len(available) == 0:
+            return []
+        target, quantity = available[0]
+        candidates = [(target, quantity)]
+        if self.kktix_args.concurrent_requests <= 1:
+            return candidates
+
+        # other targets open at the same time, tickets not started yet are queued at start_at by the scheduler
+        candidates.extend((t, q) for t, q in available[1:] if t.start_at <= target.start_at)
+        # smaller quantities of the best target
+        candidates.extend((target, q) for q in range(quantity - 1, 0, -1))
+        return candidates
+
+    def __queue_payload(self, ticket: "Ticket_Flow_KKTix.Ticket", quantity: int) -> bytes:
+        queue_payload = dict(agreeTerm=True, 
+                            currency=ticket.currency, 
+                            captcha=dict(),
+                            tickets=list())
+
+        if self.showStatus.captcha_type == 2:
+            # answered ahead of the sale, empty if nobody answered yet
+            queue_payload['custom_captcha'] = self.captcha_answer or ""
+        #TODO solve recaptcha
+        elif self.showStatus.captcha_type in [1,3]:
+            queue_payload['captcha']['responseChallenge'] = '' 
+
+        queue_payload['tickets'].append(dict(
+            id=ticket.id,
+            quantity=quantity,
+            invitationCodes=[],
+            member_code="",
+            use_qualification_id=None
+        ))
+        return json.dumps(queue_payload).encode('utf-8')
+
+    async def _sync_cookies(self) -> Optional[Dict[str, str]]:
+        '''
+        share browser cookies with the pooled http client, None if not logged in
+        '''
+        cookies = await self.page.get_cookies()
+        if any(filter(lambda c: c.name == self.SESSION_COOKIE,cookies)) == False:
+            return None
+        cookies = {cookie.name: cookie.value for cookie in cookies}
+        self.http.set_cookies(cookies)
+        return cookies
+
+    async def __arm_session(self) -> bool:
+        '''
+        refresh the session cookies and token then re-arm, False if not logged in
+        '''
+        cookies = await self._sync_cookies()
+        if cookies is None:
+            return False
+        self.xsrf_token = cookies.get('XSRF-TOKEN')
+        self.__arm_payload()
+        return True
+
+    def __arm_payload(self):
+        '''
+        serialize the queue requests for the current ShowStatus, cycling through the
+        candidates to fill every concurrent request
+        '''
+        self.armed = None
+        if self.showStatus is None or self.xsrf_token is None:
+            return
+        candidates = self.__queue_candidates()
+        if len(candidates) == 0:
+            return
+
+        requests = list()
+        for i in range(max(1, self.kktix_args.concurrent_requests)):
+            ticket, quantity = candidates[i % len(candidates)]
+            requests.append((f'#{i} {ticket.name} x{quantity}', self.__queue_payload(ticket, quantity)))
+        self.armed = self.Armed(
+            target=candidates[0][0],
+            api=self.queue_api.format(event_id=self.showStatus.event_id, token=self.xsrf_token),
+            requests=requests,
+        )
+
+    async def __queue(self, api: str, data: bytes, label: str) -> Tuple[int, Optional[str]]:
+        '''
+        (status code, token), a 200 without token is the answer before the sale opens
+        '''
+        start = time.perf_counter()
+        try:
+            response = await self.http.post(api, data=data, headers=self.queue_headers)
+        except asyncio.CancelledError:
+            logger.debug(f'Queue request {label} cancelled after {(time.perf_counter() - start) * 1000:.1f} ms')
+            raise
+        logger.debug(f'Queue request {label} {response.status_code} in {response.elapsed * 1000:.1f} ms')
+        metrics.observe('kktix.queue_request', response.elapsed)
+        if response.status_code != 200:
+            logger.error(response.text)
+            return response.status_code, None
+        body = response.json()
+        return response.status_code, body.get('token', None) if isinstance(body, dict) else None
+
+    async def __queue_fan_out(self, api: str, requests: List[Tuple[str, bytes]]) -> Tuple[Optional[str], bool]:
+        '''
+        send every queue request concurrently, the first token wins and the rest are cancelled.
+        (token, not started): the second is True when a request got a 200 without token
+        '''
+        pending = {asyncio.create_task(self.__queue(api, data, label)) for label, data in requests}
+        token = None
+        not_started = False
+        try:
+            while pending and token is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        logger.error(f'Queue request failed: {task.exception()!r}')
+                        continue
+                    status_code, result = task.result()
+                    if token is None:
+                        token = result
+                    not_started |= status_code == 200 and result is None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        return token, not_started
+
+    @metrics.timed('kktix.get_ticket')
+    async def get_ticket(self)->bool:
+        # armed ahead of time, the trigger only sends the prepared bytes
+        armed = self.armed
+        if armed is None:
+            with metrics.span('kktix.arm'):
+                if not await self.__arm_session():
+                    raise Exception("User Not Login.")
+            armed = self.armed
+        if armed is None:
+            logger.error("No tickets available")
+            return False
+
+        report = None
+        target = armed.target
+        if self.clock.now() < target.start_at:
+            logger.info(f'Wait for {target.name} to start at {target.start_at}')
+            report = await self.scheduler.wait_until(target.start_at)
+            # re-armed while waiting: captcha answer, setting reload, sold out fallback, cookies
+            armed = self.armed
+            if armed is None:
+                logger.error("No tickets available")
+                return False
+        with metrics.span('kktix.queue'):
+            page_id_token, not_started = await self.__queue_fan_out(armed.api, armed.requests)
+            # the clock is only known within its uncertainty, the sale may not be open on the server yet.
+            # only the 'not started' answer is retried, errors and rejections are not
+            while page_id_token is None and not_started and report is not None and \
+                    self.clock.now() < self.scheduler.retry_until(target.start_at):
+                logger.info('No queue token right at the start, retry')
+                await asyncio.sleep(self.scheduler.retry_delay())
+                armed = self.armed or armed
+                page_id_token, not_started = await self.__queue_fan_out(armed.api, armed.requests)
+        if report is not None:
+            logger.info(report)
+
+        if page_id_token is None:
+            logger.error('Failed to get queue token')
+            self.armed = None # re-read cookies and token on the next attempt
+            return False
+        
+        # Get order page parameter
+        order_page_api = self.order_page_id.format(token=page_id_token)
+        with metrics.span('kktix.token_poll'):
+            result = await self.poller.poll(
+                lambda: self.http.get(order_page_api),
+                lambda body: body.get('to_param', None) if isinstance(body, dict) else None,
+            )
+        if not result.ok:
+            logger.error(f'Failed to get order page id: {result.reason} after {result.attempts} polls in {result.elapsed:.2f} s')
+            return False
+        logger.debug(f'Got order page id after {result.attempts} polls in {result.elapsed * 1000:.1f} ms')
+        page_id = result.value
+
+        redirct_url = self.order_page.format(event_id = self.showStatus.event_id, page_id=page_id)
+        with metrics.span('kktix.order_page'):
+            await self._open_order_page(redirct_url)
+        return True
+
+    async def _open_event_page(self):
+        self.__expect_page_load()
+        await self.page.get(self.kktix_args.event_page)
+
+    async def _open_order_page(self, url: str):
+        if self.tab_pool is not None:
+            await self.tab_pool.open(url)
+        else:
+            await self.page.get(url)
+
+    @metrics.timed('kktix.start')
+    async def start(self):
+        await super().start()
+        if self.page is not None:
+            await self.page.send(cdp.page.enable()) # DOMContentLoaded of the event page
+        # open keep-alive connections to kktix.com & queue.kktix.com before the sale
+        with metrics.span('kktix.warm_up'):
+            await self.http.warm_up(self.kktix_args.concurrent_requests)
+        with metrics.span('kktix.clock_sync'):
+            await self.clock.sync()
+        if self.redirct_to_event_page:
+            try:
+                await self.__open_event()
+            except Exception as e:
+                logger.error(e)
+                return
+            if self.auto_buy: # in the background, the hotkey works meanwhile
+                task = asyncio.create_task(self.__auto_buy(), name='auto_buy')
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    def __has_tickets(self) -> bool:
+        return self.showStatus is not None and len(self.__queue_candidates()) > 0
+
+    async def __auto_buy(self):
+        '''
+        buy until it succeeds, `auto_buy` is turned off or the page closes
+        '''
+        attempt = True
+        try:
+            while self.auto_buy and not self.stop:
+                if attempt:
+                    self.stock_changed.clear()
+                    if await self.get_ticket():
+                        return
+                # retry as soon as the inventory monitor sees tickets coming back,
+                # without a stock event only while there is something left to buy
+                try:
+                    await asyncio.wait_for(self.stock_changed.wait(), timeout=self.AUTO_BUY_RETRY)
+                    attempt = True
+                except asyncio.TimeoutError:
+                    attempt = self.__has_tickets()
+        except Exception as e:
+            logger.error(e)
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.monitor is not None:
+            self.monitor.stop()
+        self.captcha_store.close()
+        await self.http.close()
+        await super().close()
+
+    @property
+    def can_buy(self):
+        return self.showStatus != None and self.showStatus.registerStatus != 'SOLD_OUT'
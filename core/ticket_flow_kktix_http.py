@@ -0,0 +1,94 @@
+import re
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import asyncio
+import logging
+from nodriver import cdp
+
+from .metrics import metrics
+from .session_cache import Session_Cache
+from .setting import Setting
+from .ticket_flow_kktix import Ticket_Flow_KKTix
+
+__all__ = ['Ticket_Flow_KKTix_Http']
+
+logger = logging.getLogger(__name__)
+
+class Ticket_Flow_KKTix_Http(Ticket_Flow_KKTix):
+    '''
+    KKTIX flow without a browser: login, inventory and queue all go through the http client.
+    A browser is only launched to open the order page, with the session cookies injected.
+    '''
+    BROWSERLESS = True
+
+    token_pattern = r'name="authenticity_token"[^>]*value="([^"]+)"'
+
+    def __init__(self, page: None, setting: Setting):
+        super().__init__(None, setting)
+        self.browser = None # order page browser
+
+    async def is_logged_in(self) -> bool:
+        return self.SESSION_COOKIE in self.http.cookie_values()
+
+    async def restore_session(self) -> bool:
+        cookies = self.session_cache.load(self.SESSION_COOKIE)
+        if not cookies:
+            return False
+        self.http.import_cookies(cookies)
+        return await self.is_logged_in()
+
+    async def save_session(self, timeout: float = 0) -> bool:
+        if not await self.is_logged_in():
+            return False
+        self.session_cache.save(self.http.export_cookies())
+        return True
+
+    @metrics.timed('kktix.auto_login')
+    async def auto_login(self):
+        # sign in form of the login page, the authenticity token comes with its cookies
+        response = await self.http.get(self.LOGIN_URL)
+        token = re.search(self.token_pattern, response.text)
+        if token is None:
+            logger.error('Authenticity token not found on the login page')
+            return
+        response = await self.http.post(self.LOGIN_URL, data={
+            'authenticity_token': token.group(1),
+            'user[login]': self.setting.user_info.account,
+            'user[password]': self.setting.user_info.password,
+            'user[remember_me]': '1',
+        })
+        if not await self.save_session():
+            logger.error(f'login failed ({response.status_code}), check the account in setting.json.')
+
+    async def start(self):
+        if not self.setting.auto_login and not await self.is_logged_in() and not await self.restore_session():
+            logger.error('No cached session, enable auto_login to login without a browser')
+        await super().start()
+
+    async def _fetch_inventory(self, event_id: str) -> dict:
+        response = await self.http.get(self.rigister_info_api.format(event_id=event_id))
+        body = response.json()
+        return body.get('inventory', body)
+
+    async def _sync_cookies(self) -> Optional[Dict[str, str]]:
+        cookies = self.http.cookie_values()
+        return cookies if self.SESSION_COOKIE in cookies else None
+
+    async def _open_event_page(self):
+        pass
+
+    async def _open_order_page(self, url: str):
+        import nodriver as uc
+        domain = f'.{urlsplit(self.HOME_URL).hostname}'
+        cookies = [dict(c, domain=c['domain'] or domain) for c in self.http.export_cookies()]
+        self.browser = await uc.start()
+        await self.browser.main_tab.send(cdp.network.set_cookies(Session_Cache.to_params(cookies)))
+        await self.browser.main_tab.get(url)
+
+    async def sleep(self, seconds: float = 0.25):
+        await asyncio.sleep(seconds)
+
+    @property
+    def stop(self):
+        return self.browser is not None and self.browser.stopped
@@ -0,0 +1,69 @@
+import re
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+import logging
+
+from .utils import Ticket_Rule
+
+__all__ = ['Ticket_Selector']
+
+logger = logging.getLogger(__name__)
+
+class Ticket_Selector:
+    '''
+    Ordered target rules compiled into an index over the tickets of a show.
+    `index` matches the rules once per show, `update` keeps the available
+    (ticket, quantity) pairs on each inventory change, so `best` is a lookup.
+    '''
+    def __init__(self, rules: Sequence[Ticket_Rule], num_of_ticket: int):
+        self.rules = list(rules)
+        self.num_of_ticket = num_of_ticket
+        self.patterns = [re.compile(r.pattern) if r.pattern is not None else None for r in self.rules]
+        self.tickets: Optional[Sequence] = None
+        self.matches: List[Tuple[Ticket_Rule, object]] = list()
+        self.available: List[Tuple[object, int]] = list()
+
+    def match(self, index: int, ticket) -> bool:
+        rule, pattern = self.rules[index], self.patterns[index]
+        return (rule.name is None or ticket.name == rule.name) and \
+            (pattern is None or pattern.search(ticket.name) is not None) and \
+            (rule.min_price is None or ticket.price >= rule.min_price) and \
+            (rule.max_price is None or ticket.price <= rule.max_price)
+
+    def index(self, tickets: Sequence):
+        '''
+        (rule, ticket) pairs in order of preference, a ticket belongs to the first rule matching it
+        '''
+        self.tickets = tickets
+        self.matches.clear()
+        seen = set()
+        for i, rule in enumerate(self.rules):
+            for ticket in tickets:
+                if ticket.id not in seen and self.match(i, ticket):
+                    seen.add(ticket.id)
+                    self.matches.append((rule, ticket))
+        logger.debug(f'Ticket targets: {[t.name for _, t in self.matches]}')
+
+    def update(self, now: datetime) -> List[Tuple[object, int]]:
+        '''
+        open tickets with at least `min_quantity` left, the quantity is clamped to what is left,
+        tickets not started yet keep the full quantity
+        '''
+        self.available = list()
+        for rule, ticket in self.matches:
+            ticket.sys_time = now
+            if ticket.isEnded or ticket.isSoldOut:
+                continue
+            if ticket.isStarted and ticket.ticketInventory < rule.min_quantity:
+                continue
+            quantity = rule.quantity or self.num_of_ticket
+            if ticket.isStarted:
+                quantity = min(quantity, ticket.ticketInventory)
+            if quantity < 1:
+                continue
+            self.available.append((ticket, quantity))
+        return self.available
+
+    def best(self) -> Optional[Tuple[object, int]]:
+        return self.available[0] if self.available else None
@@ -0,0 +1,330 @@
+import base64
+import dataclasses
+import functools
+import gzip
+import inspect
+import json
+import logging
+import pathlib
+import re
+import time
+from collections import defaultdict
+from inspect import iscoroutinefunction
+from types import SimpleNamespace
+from typing import Dict, List, Sequence, Tuple, Union
+from urllib.parse import urlsplit
+
+import asyncio
+from nodriver import cdp
+
+from .http_client import Http_Client, Http_Response
+
+__all__ = [
+    'Trace_Recorder',
+    'Trace_Replay',
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EVENTS = (
+    cdp.network.ResponseReceived,
+    cdp.network.ResponseReceivedExtraInfo,
+    cdp.network.LoadingFinished,
+    cdp.page.FrameNavigated,
+    cdp.page.DomContentEventFired,
+    cdp.page.JavascriptDialogOpening,
+)
+BODY_TYPES = (
+    cdp.network.ResourceType.XHR,
+    cdp.network.ResourceType.FETCH,
+    cdp.network.ResourceType.IMAGE,
+    cdp.network.ResourceType.DOCUMENT,
+)
+MAX_BODY = 1 << 20
+
+_EVENT_METHODS = {event: method for method, event in cdp.util._event_parsers.items()}
+
+def _to_json(value):
+    if hasattr(value, 'to_json'):
+        return value.to_json()
+    if isinstance(value, list):
+        return [_to_json(v) for v in value]
+    return value
+
+@functools.lru_cache(maxsize=None)
+def _param_names(event_type: type) -> Dict[str, str]:
+    '''
+    field name -> protocol name of an event, read from its generated `from_json`
+    since names like resourceIPAddressSpace don't follow from the snake case
+    '''
+    try:
+        source = inspect.getsource(event_type.from_json)
+    except (OSError, TypeError):
+        return dict()
+    return dict(re.findall(r"^\s*(\w+)=.*?json\['(\w+)'\]", source, re.MULTILINE))
+
+def _event_params(event) -> dict:
+    '''
+    CDP event back to its protocol params, the inverse of `from_json`
+    '''
+    names = _param_names(type(event))
+    params = dict()
+    for f in dataclasses.fields(event):
+        value = getattr(event, f.name)
+        if value is None:
+            continue
+        name = names.get(f.name)
+        if name is None:
+            first, *rest = f.name.rstrip('_').split('_')
+            name = first + ''.join(p.title() for p in rest)
+        params[name] = _to_json(value)
+    return params
+
+class Trace_Recorder:
+    '''
+    Writes the CDP events, evaluate results, response bodies (captcha images included)
+    and http exchanges of a session to a gzip json-lines trace.
+    '''
+    def __init__(self, path: Union[str, pathlib.Path], bodies: bool = True):
+        self.path = pathlib.Path(path)
+        self.bodies = bodies
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self.start = time.perf_counter()
+        self.page = None
+        self.body_ids = set()
+        self.tasks = set()
+
+    def write(self, kind: str, **record):
+        if self.file.closed:
+            return
+        record = dict(t=round(time.perf_counter() - self.start, 6), kind=kind, **record)
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def attach_page(self, page, event_types: Sequence[type] = DEFAULT_EVENTS):
+        self.page = page
+        for event_type in event_types:
+            page.add_handler(event_type, self.__on_event)
+
+        evaluate = page.evaluate
+        async def recorded_evaluate(expression: str, *args, **kwargs):
+            result = await evaluate(expression, *args, **kwargs)
+            try:
+                self.write('evaluate', expression=expression, result=result)
+            except TypeError: # not json, e.g. a RemoteObject or ExceptionDetails
+                pass
+            return result
+        page.evaluate = recorded_evaluate
+
+    def attach_http(self, http: Http_Client):
+        request = http.request
+        async def recorded_request(method: str, url: str, **kwargs) -> Http_Response:
+            response = await request(method, url, **kwargs)
+            self.write(
+                'http', method=method, url=url, status=response.status, headers=dict(response.headers),
+                body=base64.b64encode(response.body).decode('ascii'), elapsed=response.elapsed,
+            )
+            return response
+        http.request = recorded_request
+
+    def __on_event(self, event):
+        self.write('cdp', method=_EVENT_METHODS[type(event)], params=_event_params(event))
+        if not self.bodies:
+            return
+        if isinstance(event, cdp.network.ResponseReceived) and event.type_ in BODY_TYPES:
+            self.body_ids.add(event.request_id)
+        elif isinstance(event, cdp.network.LoadingFinished) and event.request_id in self.body_ids:
+            self.body_ids.discard(event.request_id)
+            task = asyncio.create_task(self.__save_body(event.request_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def __save_body(self, request_id: cdp.network.RequestId):
+        try:
+            body, is_base64 = await self.page.send(cdp.network.get_response_body(request_id))
+        except Exception as e:
+            logger.debug(f'No body for {request_id}: {e!r}')
+            return
+        if len(body) <= MAX_BODY:
+            self.write('body', request_id=request_id, body=body, base64=is_base64)
+
+    async def close(self):
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+        self.file.close()
+        logger.info(f'Trace written to {self.path}')
+
+class _Replay_Element:
+    async def clear_input(self):
+        pass
+
+    async def send_keys(self, text: str):
+        pass
+
+    async def click(self):
+        pass
+
+class Replay_Tab:
+    '''
+    stand-in for a nodriver Tab, answers from the trace
+    '''
+    def __init__(self, trace: "Trace_Replay"):
+        self.trace = trace
+        self.handlers = defaultdict(list)
+        self.target = SimpleNamespace(url='')
+        self.closed = False
+
+    def add_handler(self, event_type: type, callback):
+        if callback not in self.handlers[event_type]:
+            self.handlers[event_type].append(callback)
+
+    def remove_handler(self, event_type: type, callback) -> bool:
+        if callback in self.handlers[event_type]:
+            self.handlers[event_type].remove(callback)
+            return True
+        return False
+
+    async def evaluate(self, expression: str, *args, **kwargs):
+        return self.trace.evaluate(expression)
+
+    async def send(self, cmd):
+        request = next(cmd)
+        try:
+            cmd.send(self.trace.command(request))
+        except StopIteration as e:
+            return e.value
+
+    async def get(self, url: str, *args, **kwargs):
+        self.target.url = url
+        return self
+
+    async def get_cookies(self) -> List[cdp.network.Cookie]:
+        return []
+
+    async def get_content(self) -> str:
+        return ''
+
+    async def query_selector(self, selector: str):
+        return _Replay_Element()
+
+    select = wait_for = query_selector
+
+    async def wait(self, *args, **kwargs):
+        pass
+
+    async def sleep(self, seconds: float = 0.25):
+        await asyncio.sleep(seconds)
+
+class Trace_Replay:
+    '''
+    Feeds a trace back into a flow at `speed` times the original pace (0 = as fast as possible)
+    and measures how long each handler takes per event.
+    '''
+    def __init__(self, path: Union[str, pathlib.Path], speed: float = 1.0):
+        self.speed = speed
+        self.now = 0.0 # trace time of the last dispatched event
+        self.events: List[dict] = list()
+        self.bodies: Dict[str, dict] = dict()
+        self.evaluations: Dict[str, List[Tuple[float, object]]] = defaultdict(list)
+        self.exchanges: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.tasks = set()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record['kind'] == 'cdp':
+                    self.events.append(record)
+                elif record['kind'] == 'body':
+                    self.bodies[record['request_id']] = record
+                elif record['kind'] == 'evaluate':
+                    self.evaluations[record['expression']].append((record['t'], record['result']))
+                elif record['kind'] == 'http':
+                    self.exchanges[(record['method'], record['url'])].append(record)
+                    self.exchanges[(record['method'], self.__path(record['url']))].append(record)
+        self.page = Replay_Tab(self)
+
+    @staticmethod
+    def __path(url: str) -> str:
+        return urlsplit(url).path
+
+    def __latest(self, records: list, time_of):
+        '''
+        last record seen by the trace time, the first one before that
+        '''
+        latest = records[0]
+        for record in records:
+            if time_of(record) > self.now:
+                break
+            latest = record
+        return latest
+
+    def evaluate(self, expression: str):
+        results = self.evaluations.get(expression)
+        if not results:
+            raise Exception(f'{expression} is not in the trace')
+        return self.__latest(results, lambda r: r[0])[1]
+
+    def command(self, request: dict) -> dict:
+        if request['method'] == 'Network.getResponseBody':
+            body = self.bodies.get(request['params']['requestId'])
+            if body is None:
+                raise Exception(f'No body of {request["params"]["requestId"]} in the trace')
+            return dict(body=body['body'], base64Encoded=body['base64'])
+        return dict()
+
+    def attach_http(self, http: Http_Client):
+        async def replayed_request(method: str, url: str, **kwargs) -> Http_Response:
+            records = self.exchanges.get((method, url)) or self.exchanges.get((method, self.__path(url)))
+            if not records:
+                logger.debug(f'{method} {url} is not in the trace')
+                return Http_Response(url=url, status=404, body=b'')
+            record = self.__latest(records, lambda r: r['t'])
+            if self.speed > 0:
+                await asyncio.sleep(record['elapsed'] / self.speed)
+            return Http_Response(
+                url=url, status=record['status'], body=base64.b64decode(record['body']),
+                headers=record['headers'], elapsed=record['elapsed'],
+            )
+        http.request = replayed_request
+
+    def dispatch(self, event):
+        for callback in list(self.page.handlers[type(event)]):
+            name = getattr(callback, '__qualname__', repr(callback))
+            start = time.perf_counter()
+            if iscoroutinefunction(callback):
+                task = asyncio.create_task(callback(event))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                task.add_done_callback(lambda _, name=name, start=start: self.latencies[name].append(time.perf_counter() - start))
+            else:
+                callback(event)
+                self.latencies[name].append(time.perf_counter() - start)
+
+    async def run(self, timeout: float = 30, settle: float = 2) -> float:
+        '''
+        dispatch every event of the trace and wait up to `timeout` for the handlers,
+        then up to `settle` for the tasks they started (e.g. get_show_info), returns the handler time
+        '''
+        before = asyncio.all_tasks()
+        start = time.perf_counter()
+        for record in self.events:
+            if self.speed > 0:
+                delay = record['t'] / self.speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.now = record['t']
+            try:
+                event = cdp.util.parse_json_event(dict(method=record['method'], params=record['params']))
+            except (KeyError, ValueError, TypeError) as e: # recorded by another nodriver / protocol version
+                logger.warning(f'Skip {record["method"]} at {record["t"]} s: {e!r}')
+                continue
+            self.dispatch(event)
+            await asyncio.sleep(0) # let the handlers start like the real listener would
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=timeout)
+        elapsed = time.perf_counter() - start
+
+        started = asyncio.all_tasks() - before - {asyncio.current_task()}
+        if started:
+            await asyncio.wait(started, timeout=settle) # background monitors never finish
+        return elapsed
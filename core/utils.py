@@ -1,5 +1,7 @@
-from dataclasses import dataclass
+import re
+from dataclasses import dataclass, field
 from enum import Enum
+from typing import List, Optional
 
 class TICKET_WEB(Enum):
     TIXCRAFT = 0
@@ -19,11 +21,50 @@ class User_Info:
             password='enter your password'
         )
 
+@dataclass
+class Ticket_Rule:
+    '''
+    one target of the ticket selection, every given condition must match
+    '''
+    name: Optional[str] = None # exact ticket name
+    pattern: Optional[str] = None # regex searched in the ticket name
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_quantity: int = 1 # skip the ticket when fewer are left
+    quantity: Optional[int] = None # num_of_ticket if None
+
+    def __post_init__(self):
+        if self.pattern is not None:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise ValueError(f'Invalid ticket pattern {self.pattern!r}: {e}')
+        if self.min_quantity < 1:
+            raise ValueError(f'min_quantity must be at least 1, got {self.min_quantity!r}')
+
 @dataclass
 class KKTIX_Argument:
     event_page: str
     ticket_name: str
     num_of_ticket: int
+    concurrent_requests: int = 1 # number of queue requests sent at once
+    fallback_tickets: List[str] = field(default_factory=list) # ticket names tried with the extra requests
+    queue_poll_budget: float = 30 # seconds to wait for the order page after queueing
+    inventory_poll_interval: float = 1 # seconds between inventory checks
+    http_only: bool = False # no browser until the order page
+    targets: List[Ticket_Rule] = field(default_factory=list) # tried after ticket_name and fallback_tickets
+    captcha_answer: str = "" # answer of the event's custom captcha question, asked on the terminal if empty
+
+    def __post_init__(self):
+        self.targets = [t if isinstance(t, Ticket_Rule) else Ticket_Rule(**t) for t in self.targets]
+
+    @property
+    def rules(self) -> List[Ticket_Rule]:
+        '''
+        every target in order of preference
+        '''
+        names = [self.ticket_name] + [n for n in self.fallback_tickets if n != self.ticket_name]
+        return [Ticket_Rule(name=n) for n in names] + self.targets
 
     @property
     def valid_page_url(self):
@@ -35,4 +76,14 @@ class KKTIX_Argument:
             event_page="enter event url like: 'https://kktix.com/events/{event_id}/registrations/new'",
             ticket_name="enter ticket name",
             num_of_ticket=0
-        )
\ No newline at end of file
+        )
+
+@dataclass
+class Kham_Argument:
+    captcha_threshold: float = 0.3 # lowest OCR character probability worth a submission
+    captcha_max_skips: int = 2 # unsure captchas refreshed in a row before one is submitted anyway
+    auto_threshold: bool = True # tune the threshold from the checked answers of the run
+
+    @classmethod
+    def default(cls):
+        return cls()
@@ -1,48 +1,92 @@
+import argparse
 import logging
 
 import asyncio
-import keyboard
 import nodriver as uc
 
+from core.hotkey import Hotkey_Trigger
+from core.log import setup_logging
+from core.metrics import metrics
+from core.orchestrator import Orchestrator, Worker_Profile
 from core.setting import Setting
-from core.ticket_flow import get_ticket_flow
+from core.ticket_flow import get_ticket_flow_class
 
-# Setup logger
-logger = logging.getLogger('core.ticket_flow')
-
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-
-ch_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
-ch.setFormatter(ch_formatter)
-
-logger.addHandler(ch)
+logger = logging.getLogger('core')
 
 # Main function
-async def main():
+async def main(args: argparse.Namespace):
+    monitor = profiler = None
+    if args.diagnose:
+        from core.loop_monitor import Loop_Monitor, Sampling_Profiler
+        monitor = Loop_Monitor(threshold=args.lag_threshold / 1000)
+        monitor.start() # from the start, setting / OCR / browser launch block the loop too
+        profiler = Sampling_Profiler(args.diagnose, monitor=monitor)
     ticket_setting = Setting()
-    browser = await uc.start()
+    ticket_setting.start() # reload setting.json on change
+    flow_class = get_ticket_flow_class(ticket_setting.ticket_web, ticket_setting.kktix_args.http_only)
+    # warm up OCR models etc. while the browser launches
+    preload = asyncio.create_task(flow_class.preload(), name='preload')
+    browser = None if flow_class.BROWSERLESS else await uc.start()
+    await preload
 
-    ticket_helper = get_ticket_flow(browser.main_tab, ticket_setting)
+    ticket_helper = flow_class(None if browser is None else browser.main_tab, ticket_setting)
+    recorder = None
+    if args.record:
+        from core.trace import Trace_Recorder
+        recorder = Trace_Recorder(args.record)
+        if browser is not None:
+            recorder.attach_page(browser.main_tab)
+        if hasattr(ticket_helper, 'http'):
+            recorder.attach_http(ticket_helper.http)
+    if profiler is not None: # the hotkey and the auto buy loop of start() both go through the instance
+        ticket_helper.get_ticket = profiler.profile(ticket_helper.get_ticket)
+    # the browserless flow only opens a browser for the order page
+    stopped = (lambda: ticket_helper.stop) if browser is None else (lambda: browser.stopped)
     
     await ticket_helper.start()
     async def on_press():
-        while not browser.stopped:
-            if keyboard.is_pressed('b') and ticket_helper.can_buy:
-                res = await ticket_helper.get_ticket()
-                if res:
-                    print('get ticket')
-            await asyncio.sleep(0.001)
+        res = await ticket_helper.get_ticket()
+        if res:
+            print('get ticket')
+
+    async def hotkey_listener():
+        await Hotkey_Trigger('b', on_press, can_fire=lambda: ticket_helper.can_buy).run(stopped)
         print('all task stopped.')
 
-    task = asyncio.create_task(on_press(), name='hotkey_listener')
+    task = asyncio.create_task(hotkey_listener(), name='hotkey_listener')
 
-    while not browser.stopped:
-        await browser.sleep()
+    while not stopped():
+        await asyncio.sleep(0.5)
     print('browser stopped')
 
     await task
+    ticket_setting.stop()
+    await ticket_helper.close()
+    if recorder is not None:
+        await recorder.close()
+    if monitor is not None:
+        monitor.stop()
+        logger.info(monitor.report())
+    if args.metrics:
+        metrics.dump(args.metrics)
     print('done')
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Ticket Helper')
+    parser.add_argument('--metrics', metavar='PATH', help='record phase timings, write them to PATH (.json or .prom) on exit')
+    parser.add_argument('--record', metavar='PATH', help='record CDP events and http exchanges to a trace (.jsonl.gz) for benchmark.replay_bench')
+    parser.add_argument('--log-file', metavar='PATH', help='keep every DEBUG record in PATH, the console is rate limited')
+    parser.add_argument('--diagnose', metavar='DIR', help='watch the event loop for blocking calls and profile each purchase attempt, reports go to DIR')
+    parser.add_argument('--lag-threshold', type=float, default=100, metavar='MS', help='with --diagnose, log the stack of callbacks blocking the loop longer than MS')
+    parser.add_argument('--profiles', metavar='PATH', help='json list of worker profiles, run one browser process per profile')
+    parser.add_argument('--no-hotkey', action='store_true', help='with --profiles, trigger the workers as soon as they are ready')
+    args = parser.parse_args()
+    # records are written by a background thread, off the event loop. the console keeps DEBUG unless a file has it
+    setup_logging(console_level=logging.INFO if args.log_file or args.profiles else logging.DEBUG, trace_path=args.log_file)
+    if args.metrics:
+        metrics.enable()
+    if args.profiles:
+        orchestrator = Orchestrator(Worker_Profile.load(args.profiles), hotkey=None if args.no_hotkey else 'b')
+        asyncio.run(orchestrator.run())
+    else:
+        asyncio.run(main(args))
\ No newline at end of file